@@ -0,0 +1,122 @@
+import os
+import json
+import heapq
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import aiofiles
+import aiofiles.os
+
+from astrbot.api import logger
+
+# 检查点文件格式版本
+ANALYTICS_FORMAT_VERSION = 1
+
+
+class Analytics:
+    """全体用户的答题统计，每次判题后增量更新，定期写入检查点文件
+
+    - questions: 章节 -> 题目ID -> [作答次数, 答错次数]
+    - chapters: 章节 -> 用户ID -> [作答次数, 答对次数]
+    - overall: 用户ID -> [作答次数, 答对次数]（全部章节合计）
+
+    排行和难题列表在请求时用大小为 k 的堆（heapq.nlargest）选出，不需要扫描用户数据文件。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.questions: Dict[str, Dict[str, List[int]]] = {}
+        self.chapters: Dict[str, Dict[str, List[int]]] = {}
+        self.overall: Dict[str, List[int]] = {}
+        self.names: Dict[str, str] = {}  # 用户ID -> 最近一次作答时的昵称
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path: str) -> "Analytics":
+        """读取检查点，文件不存在或损坏时从空统计开始"""
+        analytics = cls(path)
+        if not os.path.exists(path):
+            return analytics
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != ANALYTICS_FORMAT_VERSION:
+                logger.warning(f"答题统计检查点版本不匹配，将重新开始统计: {path}")
+                return analytics
+            analytics.questions = data.get("questions", {})
+            analytics.chapters = data.get("chapters", {})
+            analytics.names = data.get("names", {})
+            # 全部章节合计可由各章节数据算出，不单独保存
+            for users in analytics.chapters.values():
+                for user_id, (attempts, correct) in users.items():
+                    total = analytics.overall.setdefault(user_id, [0, 0])
+                    total[0] += attempts
+                    total[1] += correct
+        except Exception as e:
+            logger.error(f"加载答题统计检查点时出错: {e}")
+        return analytics
+
+    def record(self, user_id: str, user_name: str, chapter: str, question_id: str, correct: bool):
+        """记录一次作答"""
+        question = self.questions.setdefault(chapter, {}).setdefault(question_id, [0, 0])
+        question[0] += 1
+        user = self.chapters.setdefault(chapter, {}).setdefault(user_id, [0, 0])
+        user[0] += 1
+        total = self.overall.setdefault(user_id, [0, 0])
+        total[0] += 1
+        if correct:
+            user[1] += 1
+            total[1] += 1
+        else:
+            question[1] += 1
+        if user_name:
+            self.names[user_id] = user_name
+        self.dirty = True
+
+    def top_users(self, chapter: Optional[str] = None, k: int = 10, min_attempts: int = 1) -> List[Tuple[str, int, int]]:
+        """正确率最高的 k 个用户 [(用户ID, 作答次数, 答对次数)]，正确率相同时答对多的在前"""
+        users = self.overall if chapter is None else self.chapters.get(chapter, {})
+        candidates = (
+            (user_id, attempts, correct)
+            for user_id, (attempts, correct) in users.items()
+            if attempts >= min_attempts
+        )
+        return heapq.nlargest(k, candidates, key=lambda item: (item[2] / item[1], item[2]))
+
+    def hardest_questions(self, chapter: Optional[str] = None, k: int = 10, min_attempts: int = 1,
+                          exists=None) -> List[Tuple[str, str, int, int]]:
+        """错误率最高的 k 道题 [(章节, 题目ID, 作答次数, 答错次数)]
+
+        exists 用于过滤题库中已删除的题目。
+        """
+        chapters: Iterable[str] = self.questions if chapter is None else [chapter]
+        candidates = (
+            (name, question_id, attempts, errors)
+            for name in chapters
+            for question_id, (attempts, errors) in self.questions.get(name, {}).items()
+            if attempts >= min_attempts and (exists is None or exists(question_id))
+        )
+        return heapq.nlargest(k, candidates, key=lambda item: (item[3] / item[2], item[3]))
+
+    def _dumps(self) -> str:
+        return json.dumps({
+            "version": ANALYTICS_FORMAT_VERSION,
+            "questions": self.questions,
+            "chapters": self.chapters,
+            "names": self.names,
+        }, ensure_ascii=False, separators=(",", ":"))
+
+    async def checkpoint(self):
+        """有新数据时写入检查点（先写临时文件再重命名）"""
+        if not self.dirty:
+            return
+        # 在第一次 await 之前完成序列化，保证写入的是同一时刻的快照
+        payload = self._dumps().encode("utf-8")
+        self.dirty = False
+        tmp_path = self.path + ".tmp"
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                await f.write(payload)
+            await aiofiles.os.replace(tmp_path, self.path)
+        except Exception:
+            self.dirty = True
+            raise
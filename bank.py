@@ -0,0 +1,706 @@
+"""题库加载与编译
+
+题库源文件是 data/ 下的章节 JSON。为了加快启动、减少常驻内存，可以把它们编译成一个
+紧凑的二进制文件（见 compile_bank）：
+
+    魔数 (8 字节) | 目录长度 (4 字节, 小端) | 目录 (JSON) | 各章节数据 (紧凑 JSON，依次排列)
+
+目录记录章节标题、来源文件、数据偏移/长度、各题型题目数、题目ID和内容哈希列表，以及加载报告。
+插件启动时只解析目录，章节内容通过 mmap 在第一次访问时才解码为 Question 对象。章节按来源文件名
+的自然顺序排列，编号稳定。
+
+编译时用 pydantic 逐题校验（见 QuestionModel），格式错误的题目不写入题库并记入加载报告，
+解码时不再校验；内容相同的题目（跨章节也会检查）同样记入报告。题目ID在整个题库内唯一：
+在题库中出现不止一次的ID，每一处都改写为“章节标题:原ID”并记入报告（见 qualify_question_ids）。
+改写只取决于当前题库的内容，与加载顺序、是否热重载无关，已保存的ID不会指向别的章节的题目。
+
+题库支持增量热重载（见 QuestionBank.reload）：只重新解析有变化的源文件，其余章节直接沿用。
+
+手动编译：python bank.py [数据目录] [输出文件]
+"""
+import os
+import re
+import sys
+import json
+import mmap
+import struct
+import hashlib
+from collections import Counter
+from typing import Dict, FrozenSet, Iterator, List, Literal, Optional, Set, Tuple, Union
+
+from pydantic import BaseModel, ValidationError, field_validator
+
+try:
+    from astrbot.api import logger
+except ImportError:  # 独立运行编译命令时没有 AstrBot 环境
+    import logging
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger("shuati")
+
+BANK_MAGIC = b"SHUATI4\n"
+QUESTION_TYPES = ("single", "multiple")
+# 加载报告中格式错误、ID冲突的题目各自最多记录的条数
+REPORT_MAX_INVALID = 200
+# 插件在数据目录中写出的文件都以此为前缀，题库加载时跳过
+RESERVED_PREFIX = "shuati_"
+
+
+# 作答归一化：全角字母、小写字母都转为半角大写，全角数字转为半角
+_ANSWER_TABLE = str.maketrans(
+    {**{chr(0xFF21 + i): chr(0x41 + i) for i in range(26)},
+     **{chr(0xFF41 + i): chr(0x41 + i) for i in range(26)},
+     **{chr(0x61 + i): chr(0x41 + i) for i in range(26)},
+     **{chr(0xFF10 + i): chr(0x30 + i) for i in range(10)}}
+)
+# 批量作答中的一项：题号 + 可选分隔符 + 一个或多个选项字母（字母之间可有空格或逗号）
+_BATCH_ITEM = re.compile(r"(\d+)\s*[.、．:：)）]?\s*([A-Z](?:[\s,，、]*[A-Z])*)")
+
+
+def parse_answer(text: str) -> FrozenSet[str]:
+    """把作答解析为选项字母集合，支持 A B、A,B、AB 以及全角字母和标点"""
+    return frozenset(ch for ch in text.translate(_ANSWER_TABLE) if "A" <= ch <= "Z")
+
+
+def parse_batch_answers(text: str) -> Dict[int, FrozenSet[str]]:
+    """解析批量作答，如“1A 2BD 3C”“1.A,2.B D”，返回 {题号: 选项字母集合}"""
+    answers = {}
+    for number, letters in _BATCH_ITEM.findall(text.translate(_ANSWER_TABLE)):
+        answers[int(number)] = frozenset(ch for ch in letters if "A" <= ch <= "Z")
+    return answers
+
+
+def render_question(question: "Question") -> str:
+    """题目展示文本"""
+    opts = "\n".join([f"{label}. {text}" for label, text in zip(question.labels, question.options)])
+    tips = "（多选题，请用 A B 或 AB 格式作答）" if question.type == "multiple" else "（单选题）"
+    return f"{question.text}\n{opts}\n{tips}"
+
+
+def answer_text(answer: Union[str, List[str]]) -> str:
+    """正确答案的展示文本，多选题用空格连接"""
+    return " ".join(answer) if isinstance(answer, list) else answer
+
+
+# 答案集合只有少数几种组合，所有题目共用同一个 frozenset 对象
+_ANSWER_KEYS: Dict[str, FrozenSet[str]] = {}
+
+
+def _answer_key(answer: str) -> FrozenSet[str]:
+    key = _ANSWER_KEYS.get(answer)
+    if key is None:
+        key = _ANSWER_KEYS[answer] = parse_answer(answer)
+    return key
+
+
+class Question:
+    """一道题：由已校验的题目数据构建，选项标签、选项文本和答案经过驻留，
+    展示文本和答案集合在构建时一次生成"""
+
+    __slots__ = ("id", "text", "labels", "options", "answer", "type", "key", "rendered")
+
+    def __init__(self, data: Dict, q_type: str):
+        self.id: str = sys.intern(str(data["id"]))
+        self.text: str = data["question"]
+        options = data["options"]
+        self.labels: Tuple[str, ...] = tuple(sys.intern(label) for label in options)
+        self.options: Tuple[str, ...] = tuple(sys.intern(text) for text in options.values())
+        self.answer: str = sys.intern(answer_text(data["answer"]))  # 正确答案展示文本
+        self.type: str = sys.intern(q_type)
+        self.key: FrozenSet[str] = _answer_key(self.answer)  # 正确答案集合
+        self.rendered: str = render_question(self)
+
+    def _fields(self) -> Tuple:
+        return self.id, self.text, self.labels, self.options, self.answer, self.type
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Question) and self._fields() == other._fields()
+
+    __hash__ = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "question": self.text,
+            "options": dict(zip(self.labels, self.options)),
+            "answer": self.answer,
+            "type": self.type,
+        }
+
+
+class QuestionModel(BaseModel):
+    """题库 JSON 中单道题的格式"""
+
+    id: Optional[Union[str, int]] = None
+    question: str
+    options: Dict[str, str]
+    answer: Union[str, List[str]]
+    type: Optional[Literal["single", "multiple"]] = None
+
+    @field_validator("question")
+    @classmethod
+    def _check_question(cls, value: str) -> str:
+        if not value.strip():
+            raise ValueError("题干为空")
+        return value
+
+    @field_validator("options")
+    @classmethod
+    def _check_options(cls, value: Dict[str, str]) -> Dict[str, str]:
+        if len(value) < 2:
+            raise ValueError("选项少于两个")
+        for label, text in value.items():
+            if len(label) != 1 or not "A" <= label <= "Z":
+                raise ValueError(f"选项标签 {label!r} 不是单个大写字母")
+            if not text.strip():
+                raise ValueError(f"选项 {label} 内容为空")
+        return value
+
+
+def validate_question(data, section_type: str) -> Tuple[Optional[str], Optional[str]]:
+    """校验单道题，返回 (实际题型, 错误说明)，合法时错误说明为 None"""
+    try:
+        model = QuestionModel.model_validate(data)
+    except ValidationError as e:
+        errors = [f"{'.'.join(map(str, err['loc'])) or '题目'}: {err['msg'].removeprefix('Value error, ')}"
+                  for err in e.errors()]
+        return None, "; ".join(errors)
+    q_type = model.type or section_type
+    key = parse_answer("".join(model.answer) if isinstance(model.answer, list) else model.answer)
+    if not key:
+        return None, "answer: 没有有效的选项字母"
+    if not key <= model.options.keys():
+        return None, f"answer: 选项 {''.join(sorted(key - model.options.keys()))} 不存在"
+    if q_type == "single" and len(key) != 1:
+        return None, "answer: 单选题只能有一个正确答案"
+    return q_type, None
+
+
+def content_hash(data: Dict) -> str:
+    """按题干、选项和答案计算的内容哈希，用于发现重复题目"""
+    answer = data["answer"]
+    normalized = [
+        " ".join(data["question"].split()),
+        sorted((label, " ".join(text.split())) for label, text in data["options"].items()),
+        sorted(parse_answer("".join(answer) if isinstance(answer, list) else answer)),
+    ]
+    return hashlib.sha1(json.dumps(normalized, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def validate_chapter(source: str, title: str, content, report: "LoadReport") -> Dict[str, List[Dict]]:
+    """校验章节，返回只含合法题目的章节内容（补全 type），格式错误的题目记入加载报告"""
+    cleaned: Dict[str, List[Dict]] = {t: [] for t in QUESTION_TYPES}
+    if not isinstance(content, dict):
+        report.add_invalid(source, title, None, None, "章节内容不是 JSON 对象")
+        return cleaned
+    for section_type in QUESTION_TYPES:
+        section = content.get(section_type, [])
+        if not isinstance(section, list):
+            report.add_invalid(source, title, section_type, None, "题型分组不是列表")
+            continue
+        for index, data in enumerate(section):
+            q_type, error = validate_question(data, section_type)
+            if error:
+                report.add_invalid(source, title, section_type, index, error)
+                continue
+            data["type"] = q_type
+            cleaned[section_type].append(data)
+    return cleaned
+
+
+class LoadReport:
+    """题库加载报告：无法解析的源文件、格式错误而被跳过的题目、ID冲突而被改名的题目、内容重复的题目"""
+
+    def __init__(self):
+        self.failed_sources: Dict[str, str] = {}  # 文件名 -> 错误
+        self.invalid: List[Dict] = []  # {"source", "chapter", "type", "index", "error"}
+        self.renamed: List[Dict] = []  # {"source", "chapter", "id", "new_id"}
+        self.duplicates: List[List[Tuple[str, str]]] = []  # 每组为内容相同的 [(章节, 题目ID)]
+
+    def add_invalid(self, source: str, chapter: str, section_type: Optional[str], index: Optional[int], error: str):
+        if len(self.invalid) < REPORT_MAX_INVALID:
+            self.invalid.append({"source": source, "chapter": chapter, "type": section_type,
+                                 "index": index, "error": error})
+
+    def add_renamed(self, source: str, chapter: str, question_id: str, new_id: str):
+        if len(self.renamed) < REPORT_MAX_INVALID:
+            self.renamed.append({"source": source, "chapter": chapter, "id": question_id, "new_id": new_id})
+
+    def to_dict(self) -> Dict:
+        """编译题库时写入目录（重复题目由目录中的内容哈希算出，不保存）"""
+        return {"failed_sources": self.failed_sources, "invalid": self.invalid, "renamed": self.renamed}
+
+    @classmethod
+    def from_dict(cls, data: Dict, sources: Optional[Set[str]] = None) -> "LoadReport":
+        """读取目录中的报告；指定 sources 时只保留来自这些源文件的记录"""
+        report = cls()
+        for fname, error in data.get("failed_sources", {}).items():
+            if sources is None or fname in sources:
+                report.failed_sources[fname] = error
+        report.invalid = [item for item in data.get("invalid", []) if sources is None or item["source"] in sources]
+        report.renamed = [item for item in data.get("renamed", []) if sources is None or item["source"] in sources]
+        return report
+
+    def find_duplicates(self, entries: List[Dict]):
+        """根据各章节目录项中的内容哈希找出重复题目"""
+        groups: Dict[str, List[Tuple[str, str]]] = {}
+        for entry in entries:
+            for question_id, digest in zip(entry["ids"], entry["hashes"]):
+                groups.setdefault(digest, []).append((entry["title"], question_id))
+        self.duplicates = [group for group in groups.values() if len(group) > 1]
+
+    def has_issues(self) -> bool:
+        return bool(self.failed_sources or self.invalid or self.renamed or self.duplicates)
+
+    def summary(self, limit: int = 10) -> str:
+        lines = [f"题库加载报告：{len(self.failed_sources)} 个文件无法解析，{len(self.invalid)} 道题格式错误已跳过，"
+                 f"{len(self.renamed)} 道题ID冲突已改名，{len(self.duplicates)} 组重复题目"]
+        for fname, error in self.failed_sources.items():
+            lines.append(f"  文件 {fname}: {error}")
+        for item in self.invalid[:limit]:
+            where = f"{item['type']}[{item['index']}]" if item["index"] is not None else (item["type"] or "")
+            lines.append(f"  格式错误 {item['source']} “{item['chapter']}” {where}: {item['error']}")
+        for item in self.renamed[:limit]:
+            lines.append(f"  ID冲突 {item['source']} “{item['chapter']}” {item['id']} -> {item['new_id']}")
+        for group in self.duplicates[:limit]:
+            lines.append("  重复题目 " + "、".join(f"“{title}” {question_id}" for title, question_id in group))
+        return "\n".join(lines)
+
+
+def _natural_key(name: str):
+    """自然排序：chapter_2.json 排在 chapter_10.json 之前"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def list_sources(data_dir: str) -> Dict[str, List[int]]:
+    """返回数据目录下所有章节 JSON 的 {文件名: [大小, 修改时间(ns)]}，按自然顺序排列
+
+    以 shuati_ 开头的文件是插件自己写出的数据，不作为章节来源。
+    """
+    sources = {}
+    for fname in sorted(os.listdir(data_dir), key=_natural_key):
+        if fname.endswith(".json") and not fname.startswith(RESERVED_PREFIX):
+            st = os.stat(os.path.join(data_dir, fname))
+            sources[fname] = [st.st_size, st.st_mtime_ns]
+    return sources
+
+
+def _read_source(path: str) -> Dict[str, Dict]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("文件内容应为 {章节标题: 章节内容}")
+    return data
+
+
+def assign_question_ids(content: Dict) -> Tuple[List[str], List[str]]:
+    """为没有ID的题目按题干生成稳定ID，返回章节内全部题目的 (源ID 列表, 内容哈希列表)（按存储顺序）"""
+    ids, hashes = [], []
+    for section_type in QUESTION_TYPES:
+        for question in content.get(section_type, []):
+            question_id = question.get("id")
+            if question_id is None:
+                digest = hashlib.sha1(question.get("question", "").encode("utf-8")).hexdigest()[:12]
+                question_id = question["id"] = f"h{digest}"
+            ids.append(str(question_id))
+            hashes.append(content_hash(question))
+    return ids, hashes
+
+
+def qualify_question_ids(chapters: List[Tuple[str, List[str]]]) -> List[List[str]]:
+    """把各章节的源ID变为题库内唯一的ID：只出现一次的保持不变，出现多次的每一处都改为“章节标题:原ID”
+
+    （同一章节内重复的再加 #2、#3 区分。）结果只取决于各章节的标题和源ID，不受其他章节加载先后的影响。
+    """
+    counts = Counter(question_id for _, ids in chapters for question_id in ids)
+    taken = {question_id for question_id, n in counts.items() if n == 1}
+    result = []
+    for title, ids in chapters:
+        qualified = []
+        for question_id in ids:
+            if counts[question_id] > 1:
+                new_id = f"{title}:{question_id}"
+                suffix = 2
+                while new_id in taken:
+                    new_id = f"{title}:{question_id}#{suffix}"
+                    suffix += 1
+                question_id = new_id
+                taken.add(question_id)
+            qualified.append(question_id)
+        result.append(qualified)
+    return result
+
+
+class Chapter:
+    """已解码的章节：扁平题目列表（单选在前、多选在后）和章节内的题目ID映射
+
+    章节内容必须已经过 validate_chapter 校验（编译后的题库中只有合法题目）。
+    """
+
+    __slots__ = ("title", "questions", "by_id")
+
+    def __init__(self, title: str, content: Dict):
+        self.title = title
+        self.questions: List[Tuple[Question, str]] = []
+        self.by_id: Dict[str, Tuple[Question, str]] = {}
+        for section_type in QUESTION_TYPES:
+            for data in content.get(section_type, []):
+                # 以题目中存储的题型为准，缺省时使用所在分组
+                question = Question(data, data.get("type") or section_type)
+                item = (question, question.type)
+                self.questions.append(item)
+                self.by_id[question.id] = item
+
+    def to_content(self) -> Dict[str, List[Dict]]:
+        """还原为章节 JSON 内容"""
+        content: Dict[str, List[Dict]] = {t: [] for t in QUESTION_TYPES}
+        for question, q_type in self.questions:
+            content[q_type].append(question.to_dict())
+        return content
+
+
+def _read_chapters(data_dir: str, fname: str, report: LoadReport) -> Optional[List[Tuple[str, Dict]]]:
+    """解析并校验单个源文件，返回其中的 [(章节标题, 章节内容)]，解析失败时返回 None"""
+    try:
+        chapters = _read_source(os.path.join(data_dir, fname))
+    except Exception as e:
+        logger.error(f"加载 {fname} 时出错: {e}")
+        report.failed_sources[fname] = str(e)
+        return None
+    return [(title, validate_chapter(fname, title, content, report)) for title, content in chapters.items()]
+
+
+def _iter_chapters(data_dir: str, sources: Dict[str, List[int]], report: LoadReport,
+                   previous: Optional["QuestionBank"] = None) -> Iterator[Tuple[str, str, Optional[Dict]]]:
+    """按顺序产出 (来源文件, 章节标题, 已校验的章节内容)，重复的章节标题只保留第一个
+
+    来源文件相对 previous 未变化时不重新解析，章节内容为 None，由调用方从 previous 中取用；
+    这些文件在 previous 加载报告中的记录会并入 report。
+
+    有变化的文件解析失败时（例如正在上传、只写了一半），同样沿用 previous 中该文件的章节，
+    并把 sources 中该文件的状态改回上次加载时的值，下次检查时会重新尝试解析。
+    """
+    reusable = previous.unchanged_sources(sources) if previous is not None else set()
+    if reusable:
+        carried = LoadReport.from_dict(previous.report.to_dict(), reusable)
+        report.failed_sources.update(carried.failed_sources)
+        report.invalid.extend(carried.invalid)
+    seen = set()
+    for fname in sources:
+        if fname in reusable:
+            chapters = [(title, None) for title in previous.titles_of(fname)]
+        else:
+            chapters = _read_chapters(data_dir, fname, report)
+            if chapters is None:
+                kept = previous.titles_of(fname) if previous is not None and fname in previous.sources else []
+                if kept:
+                    logger.warning(f"{fname} 解析失败，暂时沿用上次加载的 {len(kept)} 个章节")
+                    sources[fname] = previous.sources[fname]
+                    carried = LoadReport.from_dict(previous.report.to_dict(), {fname})
+                    report.invalid.extend(carried.invalid)
+                chapters = [(title, None) for title in kept]
+        for title, content in chapters:
+            if title in seen:
+                logger.warning(f"{fname} 中的章节“{title}”与已有章节重名，已跳过")
+                continue
+            seen.add(title)
+            yield fname, title, content
+
+
+def _iter_prepared(data_dir: str, sources: Dict[str, List[int]], report: LoadReport,
+                   previous: Optional["QuestionBank"] = None) -> Iterator[Tuple[str, str, Optional[Dict], List[str], List[str], List[str]]]:
+    """在 _iter_chapters 的基础上分配题库内唯一的题目ID
+
+    产出 (来源文件, 章节标题, 章节内容, ID 列表, 内容哈希列表, 源ID 列表)。沿用的章节若ID需要改写
+    （例如新加入的章节用了相同的ID），会从 previous 中取出内容重新编码，此时章节内容不为 None。
+    """
+    chapters = list(_iter_chapters(data_dir, sources, report, previous))
+    source_ids, hashes = [], []
+    for _, title, content in chapters:
+        if content is None:
+            entry = previous.entry(title)
+            source_ids.append(entry["source_ids"])
+            hashes.append(entry["hashes"])
+        else:
+            chapter_ids, chapter_hashes = assign_question_ids(content)
+            source_ids.append(chapter_ids)
+            hashes.append(chapter_hashes)
+    qualified = qualify_question_ids([(title, ids) for (_, title, _), ids in zip(chapters, source_ids)])
+    for (fname, title, content), src_ids, ids, chapter_hashes in zip(chapters, source_ids, qualified, hashes):
+        for src_id, question_id in zip(src_ids, ids):
+            if src_id != question_id:
+                report.add_renamed(fname, title, src_id, question_id)
+        if content is None:
+            old_ids = previous.entry(title)["ids"]
+            if ids == old_ids:
+                yield fname, title, None, ids, chapter_hashes, src_ids
+                continue
+            content = previous.chapter(title).to_content()
+            new_ids = dict(zip(old_ids, ids))
+            for section in content.values():
+                for question in section:
+                    question["id"] = new_ids[question["id"]]
+        else:
+            position = 0
+            for section_type in QUESTION_TYPES:
+                for question in content.get(section_type, []):
+                    question["id"] = ids[position]
+                    position += 1
+        yield fname, title, content, ids, chapter_hashes, src_ids
+
+
+def compile_bank(data_dir: str, output_path: str, previous: Optional["QuestionBank"] = None,
+                 sources: Optional[Dict[str, List[int]]] = None) -> Dict:
+    """把数据目录下的章节 JSON 校验后编译为单个题库文件，返回目录
+
+    传入 previous 时，未变化的源文件直接复制其中已编译的章节数据，不重新解析。
+    """
+    if sources is None:
+        sources = list_sources(data_dir)
+    report = LoadReport()
+    chapters = []
+    blobs = []
+    offset = 0
+    for fname, title, content, ids, hashes, source_ids in _iter_prepared(data_dir, sources, report, previous):
+        if content is None:
+            blob = previous.raw_chapter(title)
+            counts = previous.entry(title)["counts"]
+        else:
+            blob = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            counts = {t: len(content.get(t, [])) for t in QUESTION_TYPES}
+        chapters.append({
+            "title": title,
+            "source": fname,
+            "offset": offset,
+            "length": len(blob),
+            "counts": counts,
+            "ids": ids,
+            "source_ids": source_ids,
+            "hashes": hashes,
+        })
+        blobs.append(blob)
+        offset += len(blob)
+
+    directory = {"sources": sources, "chapters": chapters, "report": report.to_dict()}
+    header = json.dumps(directory, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(BANK_MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, output_path)
+    return directory
+
+
+class QuestionBank:
+    """题库：启动时只加载章节目录，章节内容在第一次访问时解码"""
+
+    def __init__(self):
+        self.chapter_keys: List[str] = []
+        self.sources: Dict[str, List[int]] = {}  # 加载时各源文件的 [大小, 修改时间]
+        self._entries: Dict[str, Dict] = {}  # 章节标题 -> 目录项
+        self._chapters: Dict[str, Chapter] = {}  # 已解码的章节
+        self._id_to_chapter: Dict[str, str] = {}  # 题目ID -> 章节标题
+        self.report = LoadReport()  # 加载报告（格式错误、重复的题目等）
+        self._file = None
+        self._mm: Optional[mmap.mmap] = None
+        self._data_start = 0
+
+    @classmethod
+    def load(cls, data_dir: str, compiled_path: str, previous: Optional["QuestionBank"] = None,
+             sources: Optional[Dict[str, List[int]]] = None) -> "QuestionBank":
+        """优先使用编译好的题库文件；文件缺失或已过期时重新编译，无法写入时直接解析 JSON"""
+        if sources is None:
+            sources = list_sources(data_dir)
+        bank = cls()
+        try:
+            if not bank._open_compiled(compiled_path, sources):
+                compile_bank(data_dir, compiled_path, previous, sources)
+                if not bank._open_compiled(compiled_path, sources):
+                    raise ValueError("编译后的题库文件与源文件不一致")
+                logger.info(f"题库已编译: {compiled_path}")
+        except Exception as e:
+            logger.warning(f"无法使用编译题库，改为直接解析 JSON: {e}")
+            bank.close()
+            bank = cls()
+            bank._load_json(data_dir, sources, previous)
+        if previous is not None:
+            # 沿用未变化章节已解码的内容，避免重复解码（题目ID被改写的章节除外）
+            reusable = previous.unchanged_sources(sources)
+            for title, entry in bank._entries.items():
+                if (entry["source"] in reusable and title not in bank._chapters and title in previous._chapters
+                        and entry["ids"] == previous.entry(title)["ids"]):
+                    bank._chapters[title] = previous._chapters[title]
+        bank.report.find_duplicates(list(bank._entries.values()))
+        if bank.report.has_issues():
+            logger.warning(bank.report.summary())
+        return bank
+
+    @classmethod
+    def reload(cls, old: "QuestionBank", data_dir: str,
+               compiled_path: str) -> Optional[Tuple["QuestionBank", Set[str]]]:
+        """增量重新加载：只重新解析有变化的源文件
+
+        返回 (新题库, 内容有变化或已删除的题目ID)；源文件都没有变化（或有变化的文件都无法解析）时返回 None。
+        旧题库在调用方切换到新题库之前保持可用。
+        """
+        sources = list_sources(data_dir)
+        if sources == old.sources:
+            return None
+        new = cls.load(data_dir, compiled_path, previous=old, sources=sources)
+        if new.sources == old.sources:  # 有变化的文件都解析失败，题库没有实际变化
+            new.close()
+            return None
+        # 解析失败而沿用旧章节的文件在 new.sources 中保留旧状态，也算作未变化
+        reusable = old.unchanged_sources(new.sources)
+        changed: Set[str] = set()
+        for title in old.chapter_keys:
+            entry = old.entry(title)
+            if entry["source"] in reusable and entry["ids"] == new._entries.get(title, {}).get("ids"):
+                continue
+            section = old.chapter(title)
+            if section is None:
+                continue
+            for question_id, (question, _) in section.by_id.items():
+                found = new.get_by_id(question_id)
+                if found is None or found[0] != question:
+                    changed.add(question_id)
+        return new, changed
+
+    def _open_compiled(self, path: str, sources: Dict[str, List[int]]) -> bool:
+        """打开编译好的题库并读取目录，源文件有变化时返回 False"""
+        if not os.path.exists(path):
+            return False
+        f = open(path, "rb")
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # 空文件无法映射
+            f.close()
+            return False
+        try:
+            if mm[:len(BANK_MAGIC)] != BANK_MAGIC:
+                raise ValueError("不是有效的题库文件")
+            (header_len,) = struct.unpack_from("<I", mm, len(BANK_MAGIC))
+            header_start = len(BANK_MAGIC) + 4
+            directory = json.loads(mm[header_start:header_start + header_len])
+        except Exception as e:
+            logger.warning(f"读取编译题库 {path} 失败，将重新编译: {e}")
+            directory = None
+        if directory is None or directory.get("sources") != sources:
+            mm.close()
+            f.close()
+            return False
+
+        self.close()
+        self._file, self._mm = f, mm
+        self._data_start = header_start + header_len
+        self.sources = directory["sources"]
+        self.report = LoadReport.from_dict(directory.get("report", {}))
+        for entry in directory["chapters"]:
+            self._add_entry(entry)
+        return True
+
+    def _load_json(self, data_dir: str, sources: Dict[str, List[int]], previous: Optional["QuestionBank"] = None):
+        """不使用编译文件，直接解析章节 JSON（未变化的源文件沿用 previous 中的章节）"""
+        self.sources = sources
+        for fname, title, content, ids, hashes, source_ids in _iter_prepared(data_dir, sources, self.report, previous):
+            if content is None:
+                section = previous.chapter(title)
+                self._add_entry(dict(previous.entry(title)))
+                self._chapters[title] = section
+                continue
+            self._add_entry({
+                "title": title,
+                "source": fname,
+                "counts": {t: len(content.get(t, [])) for t in QUESTION_TYPES},
+                "ids": ids,
+                "source_ids": source_ids,
+                "hashes": hashes,
+            })
+            self._chapters[title] = Chapter(title, content)
+
+    def _add_entry(self, entry: Dict):
+        title = entry["title"]
+        self.chapter_keys.append(title)
+        self._entries[title] = entry
+        for question_id in entry["ids"]:
+            self._id_to_chapter[question_id] = title
+
+    def chapter(self, title: str) -> Optional[Chapter]:
+        """获取章节（首次访问时从题库文件解码）"""
+        chapter = self._chapters.get(title)
+        if chapter is not None:
+            return chapter
+        entry = self._entries.get(title)
+        if entry is None or self._mm is None:
+            return None
+        start = self._data_start + entry["offset"]
+        content = json.loads(self._mm[start:start + entry["length"]])
+        chapter = self._chapters[title] = Chapter(title, content)
+        return chapter
+
+    def entry(self, title: str) -> Dict:
+        return self._entries[title]
+
+    def titles_of(self, fname: str) -> List[str]:
+        """来自指定源文件的章节标题"""
+        return [title for title in self.chapter_keys if self._entries[title]["source"] == fname]
+
+    def unchanged_sources(self, sources: Dict[str, List[int]]) -> Set[str]:
+        """与当前加载时相比没有变化的源文件"""
+        return {fname for fname, stat in sources.items() if self.sources.get(fname) == stat}
+
+    def raw_chapter(self, title: str) -> bytes:
+        """章节的紧凑 JSON 数据（已编译的直接从文件中截取）"""
+        entry = self._entries[title]
+        if self._mm is not None and "offset" in entry:
+            start = self._data_start + entry["offset"]
+            return self._mm[start:start + entry["length"]]
+        return json.dumps(self.chapter(title).to_content(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def counts(self, title: str) -> Dict[str, int]:
+        """各题型题目数（无需解码章节）"""
+        entry = self._entries.get(title)
+        return entry["counts"] if entry else {}
+
+    def size(self, title: str) -> int:
+        entry = self._entries.get(title)
+        return len(entry["ids"]) if entry else 0
+
+    def __contains__(self, question_id: str) -> bool:
+        return str(question_id) in self._id_to_chapter
+
+    def get_by_id(self, question_id) -> Optional[Tuple[Question, str, str]]:
+        """按题目ID获取 (题目, 章节, 题型)，只解码题目所在的章节"""
+        title = self._id_to_chapter.get(str(question_id))
+        if title is None:
+            return None
+        found = self.chapter(title).by_id.get(str(question_id))
+        return (found[0], title, found[1]) if found else None
+
+    def iter_questions(self) -> Iterator[Tuple[str, Question, str, str]]:
+        """遍历全部题目 (题目ID, 题目, 章节, 题型)，会解码所有章节"""
+        for title in self.chapter_keys:
+            for question_id, (question, q_type) in self.chapter(title).by_id.items():
+                yield question_id, question, title, q_type
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+if __name__ == "__main__":
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    src_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base_dir, "data")
+    out_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(src_dir, "question_bank.bin")
+    result = compile_bank(src_dir, out_path)
+    total = sum(len(c["ids"]) for c in result["chapters"])
+    print(f"已编译 {len(result['chapters'])} 个章节、{total} 道题 -> {out_path}")
+    load_report = LoadReport.from_dict(result["report"])
+    load_report.find_duplicates(result["chapters"])
+    print(load_report.summary(limit=len(load_report.invalid) + len(load_report.renamed) + len(load_report.duplicates)))
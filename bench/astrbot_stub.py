@@ -0,0 +1,177 @@
+"""AstrBot 的本地替身，用于在没有 AstrBot 的环境中离线驱动插件
+
+只实现插件用到的接口：logger、AstrBotConfig、filter、AstrMessageEvent、Context/Star/register
+以及 session_waiter。install() 会把这些替身注册到 sys.modules，之后即可导入插件。
+"""
+import sys
+import time
+import types
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+
+class AstrBotConfig(dict):
+    pass
+
+
+class _Filter:
+    """filter 装饰器替身：只记录命令名，不做任何过滤"""
+
+    class PermissionType:
+        ADMIN = "admin"
+        MEMBER = "member"
+
+    def command(self, name: str, *args, **kwargs):
+        def decorator(func):
+            func.__command_name__ = name
+            return func
+        return decorator
+
+    def permission_type(self, permission, *args, **kwargs):
+        def decorator(func):
+            func.__permission__ = permission
+            return func
+        return decorator
+
+
+class AstrMessageEvent:
+    """消息事件替身：记录插件发出的消息及发送时间"""
+
+    def __init__(self, sender_id: str, message_str: str, sender_name: Optional[str] = None, is_admin: bool = False):
+        self.sender_id = sender_id
+        self.sender_name = sender_name or sender_id
+        self.message_str = message_str
+        self.role = "admin" if is_admin else "member"
+        self.sent: List[str] = []
+        self.sent_at: List[float] = []
+
+    def get_sender_id(self) -> str:
+        return self.sender_id
+
+    def get_sender_name(self) -> str:
+        return self.sender_name
+
+    def is_admin(self) -> bool:
+        return self.role == "admin"
+
+    def plain_result(self, text: str) -> str:
+        return text
+
+    async def send(self, result: str):
+        self.sent.append(result)
+        self.sent_at.append(time.perf_counter())
+
+
+class Context:
+    pass
+
+
+class Star:
+    def __init__(self, context: Context):
+        self.context = context
+
+
+def register(*args, **kwargs):
+    def decorator(cls):
+        return cls
+    return decorator
+
+
+class SessionController:
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.stopped = False
+        self.deadline = time.monotonic() + timeout
+
+    def stop(self):
+        self.stopped = True
+
+    def keep(self, timeout: float = 0, reset_timeout: bool = False):
+        if reset_timeout:
+            self.deadline = time.monotonic() + timeout
+        else:
+            self.deadline += timeout
+
+
+class SessionFilter:
+    pass
+
+
+class SessionRegistry:
+    """按发送者路由后续消息：会话等待期间，deliver() 投递的消息交给该会话处理"""
+
+    def __init__(self):
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.opened: Dict[str, asyncio.Event] = {}
+        self.timeouts = 0
+
+    def _opened_event(self, sender_id: str) -> asyncio.Event:
+        event = self.opened.get(sender_id)
+        if event is None:
+            event = self.opened[sender_id] = asyncio.Event()
+        return event
+
+    async def wait_open(self, sender_id: str):
+        """等待该用户的会话开始等待回复"""
+        await self._opened_event(sender_id).wait()
+
+    async def deliver(self, event: AstrMessageEvent):
+        await self.queues[event.get_sender_id()].put(event)
+
+    async def run(self, handler, timeout: float, event: AstrMessageEvent):
+        sender_id = event.get_sender_id()
+        queue = self.queues[sender_id] = asyncio.Queue()
+        controller = SessionController(timeout)
+        self._opened_event(sender_id).set()
+        try:
+            while not controller.stopped:
+                remaining = controller.deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("会话超时")
+                try:
+                    reply = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    raise TimeoutError("会话超时")
+                await handler(controller, reply)
+        finally:
+            self.queues.pop(sender_id, None)
+            self.opened.pop(sender_id, None)
+
+
+sessions = SessionRegistry()
+
+
+def session_waiter(timeout: int = 30, record_history_chains: bool = False):
+    def decorator(handler):
+        async def wrapper(event: AstrMessageEvent, *args, **kwargs):
+            await sessions.run(handler, timeout, event)
+        return wrapper
+    return decorator
+
+
+def install():
+    """把替身模块注册到 sys.modules（已安装真正的 AstrBot 时也会被覆盖）"""
+    modules = {name: types.ModuleType(name) for name in (
+        "astrbot", "astrbot.api", "astrbot.api.event", "astrbot.api.star",
+        "astrbot.api.message_components", "astrbot.core", "astrbot.core.utils",
+        "astrbot.core.utils.session_waiter",
+    )}
+    api = modules["astrbot.api"]
+    api.logger = logging.getLogger("astrbot")
+    api.AstrBotConfig = AstrBotConfig
+    modules["astrbot.api.event"].filter = _Filter()
+    modules["astrbot.api.event"].AstrMessageEvent = AstrMessageEvent
+    modules["astrbot.api.star"].Context = Context
+    modules["astrbot.api.star"].Star = Star
+    modules["astrbot.api.star"].register = register
+    waiter = modules["astrbot.core.utils.session_waiter"]
+    waiter.session_waiter = session_waiter
+    waiter.SessionController = SessionController
+    waiter.SessionFilter = SessionFilter
+    for name, module in modules.items():
+        parent, _, child = name.rpartition(".")
+        if parent:
+            setattr(modules[parent], child, module)
+        sys.modules[name] = module
@@ -0,0 +1,263 @@
+"""刷题插件离线压测
+
+用 AstrBot 替身（astrbot_stub.py）驱动插件，模拟大量用户同时刷题：随机刷题、顺序刷题、
+错题复习和查看统计。统计每个命令的 p50/p99 延迟、答题吞吐、写入用户数据的次数和字节数、
+以及内存峰值，并把结果保存为 JSON 以便与之前的结果对比。
+
+    python bench/run_bench.py --users 2000 --rounds 5
+    python bench/run_bench.py --backend sqlite --compare bench/results/20261017-120000-json.json
+"""
+import os
+import sys
+import json
+import time
+import types
+import random
+import asyncio
+import inspect
+import logging
+import argparse
+import platform
+import tempfile
+import importlib
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+import astrbot_stub
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# 各命令被选中的权重
+COMMAND_WEIGHTS = {
+    "start_quiz": 4,
+    "order_quiz": 3,
+    "practice_wrong_questions": 2,
+    "show_statistics": 1,
+}
+
+
+def load_plugin_module():
+    """安装 AstrBot 替身，并把插件目录作为 shuati 包导入"""
+    astrbot_stub.install()
+    package = types.ModuleType("shuati")
+    package.__path__ = [PLUGIN_DIR]
+    sys.modules["shuati"] = package
+    return importlib.import_module("shuati.main")
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarize(values: List[float]) -> Dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+    }
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def random_answer(rng: random.Random) -> str:
+    letters = "ABCD"
+    if rng.random() < 0.7:
+        return rng.choice(letters)
+    return " ".join(sorted(rng.sample(letters, rng.randint(2, 4))))
+
+
+class Bench:
+    def __init__(self, plugin, args):
+        self.plugin = plugin
+        self.args = args
+        self.latencies: Dict[str, List[float]] = {name: [] for name in COMMAND_WEIGHTS}
+        self.answer_latencies: List[float] = []
+        self.errors = 0
+
+    def _invoke(self, name: str, event, rng: random.Random):
+        chapters = self.plugin.bank.chapter_keys
+        chapter_index = rng.randrange(len(chapters))
+        if name == "start_quiz":
+            event.message_str = f"/shuati {chapter_index}"
+            return self.plugin.start_quiz(event, str(chapter_index))
+        if name == "order_quiz":
+            size = self.plugin.bank.size(chapters[chapter_index])
+            event.message_str = f"/顺序刷题 {chapter_index} {rng.randrange(max(size, 1))}"
+            return self.plugin.order_quiz(event)
+        if name == "practice_wrong_questions":
+            event.message_str = "/wrong"
+            return self.plugin.practice_wrong_questions(event)
+        event.message_str = "/stats"
+        return self.plugin.show_statistics(event)
+
+    @staticmethod
+    async def _consume(result, event):
+        """命令处理函数可能是异步生成器（yield 结果）或普通协程"""
+        if inspect.isasyncgen(result):
+            async for item in result:
+                await event.send(item)
+        else:
+            await result
+
+    async def run_command(self, user_id: str, name: str, rng: random.Random):
+        """执行一条命令；插件打开答题会话时回复一次答案"""
+        event = astrbot_stub.AstrMessageEvent(user_id, "")
+        start = time.perf_counter()
+        task = asyncio.ensure_future(self._consume(self._invoke(name, event, rng), event))
+        opened = asyncio.ensure_future(astrbot_stub.sessions.wait_open(user_id))
+        done, _ = await asyncio.wait({task, opened}, return_when=asyncio.FIRST_COMPLETED)
+        first_sent = event.sent_at[0] if event.sent_at else time.perf_counter()
+        self.latencies[name].append(first_sent - start)
+
+        if opened in done and not task.done():
+            if self.args.think_ms:
+                await asyncio.sleep(self.args.think_ms / 1000)
+            reply = astrbot_stub.AstrMessageEvent(user_id, random_answer(rng))
+            answered = time.perf_counter()
+            await astrbot_stub.sessions.deliver(reply)
+            await task
+            verdict = reply.sent_at[0] if reply.sent_at else time.perf_counter()
+            self.answer_latencies.append(verdict - answered)
+        else:
+            opened.cancel()
+            await task
+
+    async def run_user(self, index: int, gate: asyncio.Semaphore):
+        rng = random.Random(self.args.seed * 1_000_003 + index)
+        user_id = f"bench_{index}"
+        names, weights = zip(*COMMAND_WEIGHTS.items())
+        async with gate:
+            for _ in range(self.args.rounds):
+                try:
+                    await self.run_command(user_id, rng.choices(names, weights)[0], rng)
+                except Exception as e:
+                    self.errors += 1
+                    logging.getLogger("bench").warning(f"{user_id} 执行命令出错: {e!r}")
+
+
+async def run(args) -> Dict:
+    main = load_plugin_module()
+    work_dir = tempfile.mkdtemp(prefix="shuati_bench_")
+    main.USER_DATA_DIR = os.path.join(work_dir, "shuati_user_data")
+    main.SQLITE_PATH = os.path.join(work_dir, "shuati_user_data.db")
+    main.ANALYTICS_PATH = os.path.join(work_dir, "shuati_analytics.ckpt")
+    main.COMPILED_BANK_PATH = os.path.join(work_dir, "question_bank.bin")
+    main.BANK_RELOAD_INTERVAL = 0
+
+    started = time.perf_counter()
+    plugin = main.ShuatiPlugin(astrbot_stub.Context(), astrbot_stub.AstrBotConfig(storage_backend=args.backend))
+    startup = time.perf_counter() - started
+
+    bench = Bench(plugin, args)
+    gate = asyncio.Semaphore(args.concurrency or args.users)
+    started = time.perf_counter()
+    await asyncio.gather(*(bench.run_user(i, gate) for i in range(args.users)))
+    await plugin.terminate()
+    wall = time.perf_counter() - started
+
+    disk_bytes = 0
+    for root, _, files in os.walk(work_dir):
+        disk_bytes += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "users": args.users,
+            "rounds": args.rounds,
+            "concurrency": args.concurrency or args.users,
+            "backend": args.backend,
+            "think_ms": args.think_ms,
+            "seed": args.seed,
+            "python": platform.python_version(),
+        },
+        "startup_ms": round(startup * 1000, 3),
+        "wall_seconds": round(wall, 3),
+        "commands": {name: summarize(values) for name, values in bench.latencies.items()},
+        "answers": dict(summarize(bench.answer_latencies),
+                        per_second=round(len(bench.answer_latencies) / wall, 1) if wall else 0.0),
+        "user_data": {
+            "writes": plugin.store.writes,
+            "bytes_written": plugin.store.bytes_written,
+            "disk_bytes": disk_bytes,
+        },
+        "session_timeouts": astrbot_stub.sessions.timeouts,
+        "errors": bench.errors,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def flatten(result: Dict, prefix: str = "") -> Dict[str, float]:
+    """把结果展开为 {指标路径: 数值}，用于对比"""
+    flat = {}
+    for key, value in result.items():
+        if key == "meta":
+            continue
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def print_report(result: Dict, baseline: Optional[Dict] = None):
+    current = flatten(result)
+    previous = flatten(baseline) if baseline else {}
+    width = max(len(k) for k in current)
+    for key, value in current.items():
+        line = f"{key:<{width}}  {value:>12}"
+        old = previous.get(key)
+        if old is not None:
+            change = f"{(value - old) / old * 100:+.1f}%" if old else "n/a"
+            line += f"  (之前 {old}，{change})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="刷题插件离线压测")
+    parser.add_argument("--users", type=int, default=1000, help="模拟用户数")
+    parser.add_argument("--rounds", type=int, default=5, help="每个用户执行的命令数")
+    parser.add_argument("--concurrency", type=int, default=0, help="同时活跃的用户数上限，0 表示全部同时进行")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json", help="用户数据存储后端")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="收到题目后到作答的等待时间（毫秒）")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    parser.add_argument("--output", help="结果保存路径，默认保存到 bench/results/")
+    parser.add_argument("--compare", help="与之前保存的结果对比")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = asyncio.run(run(args))
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{args.backend}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    print(f"\n结果已保存到 {output}")
+
+
+if __name__ == "__main__":
+    main()
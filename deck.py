@@ -0,0 +1,53 @@
+import random
+from typing import List, Optional, Tuple
+
+_MASK64 = (1 << 64) - 1
+# Feistel 轮数：4 轮即可得到足够均匀的伪随机排列
+_ROUNDS = 4
+
+
+def _mix(x: int) -> int:
+    """splitmix64 的混合函数"""
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+def permute(index: int, size: int, seed: int) -> int:
+    """由 seed 确定的 [0, size) 上的伪随机排列中第 index 个元素
+
+    在不小于 size 的 2 的偶数次幂范围内做 Feistel 置换，结果超出 size 时继续置换（cycle walking），
+    期望不超过 4 次即可落回范围内。不需要生成整个排列，每次 O(1)。
+    """
+    if size <= 1:
+        return 0
+    bits = (size - 1).bit_length()
+    half = (bits + 1) // 2
+    mask = (1 << half) - 1
+    key = _mix(seed)
+    x = index
+    while True:
+        left, right = x >> half, x & mask
+        for r in range(_ROUNDS):
+            left, right = right, left ^ (_mix(key ^ (r << 40) ^ right) & mask)
+        x = (left << half) | right
+        if x < size:
+            return x
+
+
+def new_deck(size: int) -> List[int]:
+    """新洗一副牌：[排列种子, 已抽张数, 牌数]"""
+    return [random.getrandbits(32), 0, size]
+
+
+def draw(deck: Optional[List[int]], size: int) -> Tuple[List[int], int]:
+    """抽下一张牌，返回 (牌组, 题目序号)；本轮抽完或题目数有变化时重新洗牌
+
+    传入的牌组会被原地更新，重新洗牌时返回新的牌组。
+    """
+    if not deck or deck[2] != size or deck[1] >= size:
+        deck = new_deck(size)
+    index = permute(deck[1], size, deck[0])
+    deck[1] += 1
+    return deck, index
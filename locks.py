@@ -0,0 +1,45 @@
+import asyncio
+import zlib
+from typing import Dict, List
+
+
+class StripedLocks:
+    """按用户ID分段的 asyncio 锁表：同一用户总是落到同一把锁上，不同用户大多互不影响
+
+    锁的数量固定，不随用户数增长；两个用户偶尔共用一把锁只会让彼此短暂排队。
+    """
+
+    def __init__(self, stripes: int = 64):
+        self._locks: List[asyncio.Lock] = [asyncio.Lock() for _ in range(max(1, stripes))]
+
+    def __call__(self, user_id: str) -> asyncio.Lock:
+        # 用 crc32 而不是 hash()，保证同一用户ID在不同进程中也落在同一段
+        return self._locks[zlib.crc32(user_id.encode("utf-8")) % len(self._locks)]
+
+
+class SessionLimiter:
+    """限制每个用户同时进行的答题会话数，limit 为 0 表示不限制"""
+
+    def __init__(self, limit: int = 1):
+        self.limit = limit
+        self._active: Dict[str, int] = {}
+        self.rejected = 0
+
+    def acquire(self, user_id: str) -> bool:
+        """占用一个会话名额，已达上限时返回 False"""
+        active = self._active.get(user_id, 0)
+        if self.limit > 0 and active >= self.limit:
+            self.rejected += 1
+            return False
+        self._active[user_id] = active + 1
+        return True
+
+    def release(self, user_id: str):
+        active = self._active.get(user_id, 0) - 1
+        if active > 0:
+            self._active[user_id] = active
+        else:
+            self._active.pop(user_id, None)
+
+    def active_count(self) -> int:
+        return sum(self._active.values())
@@ -1,29 +1,94 @@
 import os
-import json
-import random
+import asyncio
 import time
-from typing import Dict, List, Tuple, Union, Optional
+import aiofiles
+from itertools import islice
+from typing import Dict, FrozenSet, List, Set, Tuple, Union, Optional
 
 import astrbot.api.message_components as Comp
 from astrbot.api.event import filter, AstrMessageEvent
 from astrbot.api.star import Context, Star, register
-from astrbot.api import logger
+from astrbot.api import logger, AstrBotConfig
 from astrbot.core.utils.session_waiter import session_waiter, SessionController, SessionFilter
 
+from .storage import JsonUserStore, SqliteUserStore, UserDataCache, WriteBehindWriter
+from .review import ReviewScheduler
+from .bank import Question, QuestionBank, parse_answer, parse_batch_answers
+from .metrics import Metrics, add_session_wait, timed_command
+from .locks import SessionLimiter, StripedLocks
+from .analytics import Analytics
+from .search import SearchIndex
+from .deck import draw
+
 # 数据存储路径
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 USER_DATA_DIR = os.path.join(DATA_DIR, "shuati_user_data")
+SQLITE_PATH = os.path.join(DATA_DIR, "shuati_user_data.db")
+# 全体用户答题统计的检查点文件
+# （不用 .json 后缀，避免被当作章节来源；旧版本写在 shuati_analytics.json，启动时自动改名）
+ANALYTICS_PATH = os.path.join(DATA_DIR, "shuati_analytics.ckpt")
+# 编译后的题库文件（由章节 JSON 自动生成）
+COMPILED_BANK_PATH = os.path.join(DATA_DIR, "question_bank.bin")
+# 检查题库文件是否有改动的间隔（秒），0 表示不自动重新加载
+BANK_RELOAD_INTERVAL = 10.0
+# 用户数据后台写盘间隔（秒），以及触发立即写盘的脏用户数
+SAVE_INTERVAL = 5.0
+SAVE_BATCH_SIZE = 50
+# 内存中最多缓存的用户数，以及用户空闲多久（秒）后移出缓存
+USER_CACHE_SIZE = 1000
+USER_CACHE_TTL = 1800.0
+# 用户数据格式版本：2 表示错题本只保存题目ID及元数据
+USER_DATA_FORMAT_VERSION = 2
+# 批量刷题：单次最多题数、每条消息包含的题数、每道题增加的作答时间（秒）
+BATCH_MAX_QUESTIONS = 50
+BATCH_MESSAGE_SIZE = 10
+BATCH_SECONDS_PER_QUESTION = 30
+# 事件循环延迟的采样间隔（秒），以及写出 Prometheus 指标文件的间隔（秒）
+LOOP_LAG_INTERVAL = 1.0
+METRICS_WRITE_INTERVAL = 15.0
+# 用户锁的分段数（同一段内的用户共用一把锁）
+USER_LOCK_STRIPES = 64
+# 答题统计写检查点的间隔（秒）
+ANALYTICS_CHECKPOINT_INTERVAL = 60.0
+# 排行榜和难题列表的条数，以及上榜所需的最少作答次数
+RANK_SIZE = 10
+RANK_MIN_ANSWERS = 10
+HARD_QUESTION_MIN_ANSWERS = 5
+# 搜题最多返回的题数
+SEARCH_RESULT_LIMIT = 10
 
 
 @register("shuati", "xiazhimiao", "期末考试刷题插件（带错题本功能）", "1.9", "https://github.com/xiazhimiao/shuati")
 class ShuatiPlugin(Star):
-    def __init__(self, context: Context):
+    def __init__(self, context: Context, config: Optional[AstrBotConfig] = None):
         super().__init__(context)
-        self.questions: Dict[str, Dict] = {}
-        self.chapter_keys: List[str] = []
-        self.user_data: Dict[str, Dict] = {}  # 缓存用户数据
+        self.config = config or {}
+        self.metrics = Metrics()  # 命令、判题、缓存、写盘等运行指标
+        self.bank: QuestionBank = QuestionBank()  # 题库（章节按需解码）
+        self._question_ids_by_text: Optional[Dict[str, str]] = None  # 题干 -> 题目ID，仅整理旧版错题本时临时使用
+        self._search_index: Optional[SearchIndex] = None  # 搜题索引，第一次搜题时建立
+        self.user_data = UserDataCache(USER_CACHE_SIZE, USER_CACHE_TTL, on_evict=self._on_user_evicted)  # 缓存用户数据
+        self.scheduler = ReviewScheduler()  # 错题复习调度（每个用户一个按到期时间排序的堆）
+        self.user_locks = StripedLocks(USER_LOCK_STRIPES)  # 修改、保存用户数据时持有的用户锁
+        self.session_limiter = SessionLimiter(self._get_session_limit())  # 每个用户同时进行的答题会话数
         self._load_all_chapters()
         self._ensure_user_data_dir_exists()
+        self.store = self._create_store()
+        self.writer = WriteBehindWriter(self.store, interval=SAVE_INTERVAL, max_pending=SAVE_BATCH_SIZE,
+                                        metrics=self.metrics)
+        self.metrics.add_collector(self._collect_metrics)
+        self._compact_user_data()
+        # 旧版本的检查点与 ANALYTICS_PATH 同目录同名，只是后缀为 .json
+        legacy_analytics_path = os.path.splitext(ANALYTICS_PATH)[0] + ".json"
+        if os.path.exists(legacy_analytics_path) and not os.path.exists(ANALYTICS_PATH):
+            os.replace(legacy_analytics_path, ANALYTICS_PATH)
+        self.analytics = Analytics.load(ANALYTICS_PATH)  # 全体用户的每题、每章答题统计
+        self._reload_task: Optional[asyncio.Task] = None
+        self._metrics_task: Optional[asyncio.Task] = None
+        self._checkpoint_task: Optional[asyncio.Task] = None
+        self._start_bank_watcher()
+        self._start_metrics_task()
+        self._start_analytics_checkpoints()
         logger.info("Shuati 插件初始化完成")
 
     def _ensure_user_data_dir_exists(self):
@@ -31,147 +96,399 @@ class ShuatiPlugin(Star):
         if not os.path.exists(USER_DATA_DIR):
             os.makedirs(USER_DATA_DIR)
 
+    def _create_store(self) -> Union[JsonUserStore, SqliteUserStore]:
+        """按配置创建用户数据存储（json 或 sqlite）"""
+        backend = str(self.config.get("storage_backend", "json")).lower()
+        if backend == "sqlite":
+            store = SqliteUserStore(SQLITE_PATH)
+            # 首次启用 SQLite 时导入已有的 JSON 用户数据
+            store.migrate_from_json(USER_DATA_DIR)
+            logger.info(f"Shuati 使用 SQLite 存储用户数据: {SQLITE_PATH}")
+            return store
+        if backend != "json":
+            logger.warning(f"未知的存储后端 {backend}，将使用 JSON 文件存储")
+        return JsonUserStore(USER_DATA_DIR)
+
+    def _get_session_limit(self) -> int:
+        """每个用户最多同时进行的答题会话数（配置项 max_sessions_per_user，0 表示不限制）"""
+        try:
+            return max(0, int(self.config.get("max_sessions_per_user", 1)))
+        except (TypeError, ValueError):
+            logger.warning("max_sessions_per_user 配置无效，将限制每个用户同时只能进行一个答题会话")
+            return 1
+
     def _load_all_chapters(self):
-        """加载所有章节题目数据"""
-        for fname in os.listdir(DATA_DIR):
-            if fname.endswith(".json"):
-                path = os.path.join(DATA_DIR, fname)
-                with open(path, encoding="utf-8") as f:
-                    try:
-                        data = json.load(f)
-                        for chapter_title, content in data.items():
-                            self.questions[chapter_title] = content
-                            self.chapter_keys.append(chapter_title)
-                    except Exception as e:
-                        logger.error(f"加载 {fname} 时出错: {e}")
-
-    def _get_random_question(self, chapter: str) -> Tuple[Dict, str]:
-        """从指定章节获取随机题目"""
-        section = self.questions.get(chapter)
-        if not section:
-            return None, None
+        """加载题库目录（章节内容在第一次使用时才解码）"""
+        self.bank = QuestionBank.load(DATA_DIR, COMPILED_BANK_PATH)
+        logger.info(f"题库加载完成，共 {len(self.bank.chapter_keys)} 个章节")
 
-        q_type = random.choice(["single", "multiple"])
-        q_list = section.get(q_type, [])
-        if not q_list:
-            return None, None
+    def _start_bank_watcher(self):
+        """启动后台任务，定期检查题库文件的改动"""
+        if BANK_RELOAD_INTERVAL <= 0:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("当前没有运行中的事件循环，题库热重载未启用")
+            return
+        self._reload_task = loop.create_task(self._watch_bank())
 
-        question = random.choice(q_list)
-        return question, q_type
+    async def _watch_bank(self):
+        while True:
+            await asyncio.sleep(BANK_RELOAD_INTERVAL)
+            try:
+                self._reload_bank()
+            except Exception as e:
+                logger.error(f"重新加载题库时出错: {e}")
+
+    def _reload_bank(self) -> bool:
+        """按文件大小和修改时间检测题库改动，只重新解析变化的章节文件并整体切换"""
+        result = QuestionBank.reload(self.bank, DATA_DIR, COMPILED_BANK_PATH)
+        if result is None:
+            return False
+        new_bank, changed_ids = result
+        # 一次赋值完成切换；进行中的答题会话持有的是题目对象本身，不受影响
+        old_bank, self.bank = self.bank, new_bank
+        old_bank.close()
+        self._revalidate_wrong_books(changed_ids)
+        logger.info(f"题库已重新加载，共 {len(new_bank.chapter_keys)} 个章节，{len(changed_ids)} 道题有改动或被删除")
+        return True
+
+    def _revalidate_wrong_books(self, changed_ids: Set[str]):
+        """题目改动后整理缓存中用户的错题本：已删除的题目移除，内容有改动的重新安排复习
+
+        未在缓存中的用户会在取题时跳过并移除已删除的题目。
+        """
+        if not changed_ids:
+            return
+        for user_id in self.user_data:
+            data = self.user_data.peek(user_id)
+            wrong_questions = data["wrong_questions"]
+            affected = changed_ids.intersection(wrong_questions)
+            for question_id in affected:
+                if question_id in self.bank:
+                    self.scheduler.schedule_new(user_id, wrong_questions, question_id)
+                else:
+                    del wrong_questions[question_id]
+            if affected:
+                self._save_user_data(user_id)
 
-    def _get_chapter_questions(self, chapter: str) -> List[Dict]:
-        """获取指定章节的所有题目（按存储顺序排列）"""
-        section = self.questions.get(chapter)
-        if not section:
-            return []
-        
-        # 合并单选和多选题，保持原始顺序
-        all_questions = []
-        for q_type in ["single", "multiple"]:
-            all_questions.extend(section.get(q_type, []))
-        return all_questions
+    def _collect_metrics(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """采集缓存和写盘队列的当前数值（渲染指标时调用）"""
+        stats = self.user_data.stats()
+        return [
+            ("shuati_user_cache_hits_total", {}, stats["hits"]),
+            ("shuati_user_cache_misses_total", {}, stats["misses"]),
+            ("shuati_user_cache_evictions_total", {}, stats["evictions"]),
+            ("shuati_user_cache_size", {}, stats["size"]),
+            ("shuati_save_pending", {}, self.writer.pending_count()),
+            ("shuati_active_sessions", {}, self.session_limiter.active_count()),
+            ("shuati_session_rejected_total", {}, self.session_limiter.rejected),
+        ]
+
+    def _start_metrics_task(self):
+        """启动后台任务，采样事件循环延迟并按配置定期写出指标文件"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("当前没有运行中的事件循环，事件循环延迟采样和指标文件导出未启用")
+            return
+        self._metrics_task = loop.create_task(self._run_metrics())
+
+    async def _run_metrics(self):
+        metrics_file = self.config.get("metrics_file") or ""
+        last_write = time.monotonic()
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            now = time.monotonic()
+            # 实际睡眠时间超出预期的部分即为事件循环被占用的时间
+            self.metrics.observe("shuati_event_loop_lag_seconds", max(0.0, now - started - LOOP_LAG_INTERVAL))
+            if metrics_file and now - last_write >= METRICS_WRITE_INTERVAL:
+                last_write = now
+                try:
+                    await self._write_metrics_file(metrics_file)
+                except Exception as e:
+                    logger.error(f"写出指标文件时出错: {e}")
+
+    async def _write_metrics_file(self, path: str):
+        """以 Prometheus 文本格式写出指标（先写临时文件再替换，供 node_exporter textfile 采集）"""
+        tmp_path = f"{path}.tmp"
+        async with aiofiles.open(tmp_path, "w", encoding="utf-8") as f:
+            await f.write(self.metrics.render_prometheus())
+        os.replace(tmp_path, path)
+
+    def _start_analytics_checkpoints(self):
+        """启动后台任务，定期把答题统计写入检查点"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("当前没有运行中的事件循环，答题统计只在插件卸载时保存")
+            return
+        self._checkpoint_task = loop.create_task(self._run_analytics_checkpoints())
+
+    async def _run_analytics_checkpoints(self):
+        while True:
+            await asyncio.sleep(ANALYTICS_CHECKPOINT_INTERVAL)
+            try:
+                await self.analytics.checkpoint()
+            except Exception as e:
+                logger.error(f"保存答题统计时出错: {e}")
+
+    async def _open_session(self, event: AstrMessageEvent, user_id: str) -> bool:
+        """占用一个答题会话名额，超出每个用户的上限时提示并返回 False（成功后须调用 release）"""
+        if self.session_limiter.acquire(user_id):
+            return True
+        await event.send(event.plain_result(
+            f"你已有{self.session_limiter.limit}个进行中的答题，请先作答或等待超时后再开始新的题目。"))
+        return False
+
+    async def _wait_session(self, waiter, event: AstrMessageEvent):
+        """等待用户作答，记录等待时间（不计入命令耗时）以及超时、异常次数"""
+        started = time.perf_counter()
+        try:
+            await waiter(event)
+        except TimeoutError:
+            self.metrics.inc("shuati_session_timeouts_total")
+            raise
+        except Exception:
+            self.metrics.inc("shuati_session_errors_total")
+            raise
+        finally:
+            add_session_wait(time.perf_counter() - started)
+
+    def _get_search_index(self) -> SearchIndex:
+        """获取搜题索引；题库有变化时重建（只重新索引来源文件有变化的章节）"""
+        index = self._search_index
+        if index is None or index.sources != self.bank.sources:
+            started = time.perf_counter()
+            index = self._search_index = SearchIndex.build(self.bank, previous=index)
+            logger.info(f"搜题索引已建立，耗时 {(time.perf_counter() - started) * 1000:.1f}ms")
+        return index
+
+    async def _draw_questions(self, user_id: str, chapter: str, count: int) -> List[Tuple[Question, str]]:
+        """从用户在该章节的牌组中抽取不重复的题目
+
+        每个用户每章一副洗好的牌（只保存排列种子和已抽张数），抽完整章后才重新洗牌，
+        题目按各题型的实际数量均匀出现。
+        """
+        questions = self._get_chapter_questions(chapter)
+        count = min(count, len(questions))
+        picked: List[Tuple[Question, str]] = []
+        seen: Set[int] = set()
+        async with self.user_locks(user_id):
+            user_data = self._get_user_data(user_id)
+            decks = user_data.setdefault("decks", {})
+            while len(picked) < count:
+                # 一批题跨过重新洗牌时，跳过本批已抽到的题目
+                decks[chapter], index = draw(decks.get(chapter), len(questions))
+                if index not in seen:
+                    seen.add(index)
+                    picked.append(questions[index])
+            self._save_user_data(user_id)
+        return picked
 
-    def _get_question_by_index(self, chapter: str, index: int) -> Tuple[Dict, str]:
+    def _get_chapter_questions(self, chapter: str) -> List[Tuple[Question, str]]:
+        """获取指定章节的所有题目及题型（按存储顺序排列，返回预建索引，请勿修改）"""
+        section = self.bank.chapter(chapter)
+        return section.questions if section else []
+
+    def _get_question_by_index(self, chapter: str, index: int) -> Tuple[Question, str]:
         """按索引获取章节中的题目及题型"""
         questions = self._get_chapter_questions(chapter)
-        if index < 0 or index >= len(questions):
+        if not questions or index < 0 or index >= len(questions):
             return None, None
-        
-        question = questions[index]
-        q_type = "single" if len(question.get("answer", "")) == 1 else "multiple"
-        return question, q_type
+        return questions[index]
+
+    def _get_question_by_id(self, question_id) -> Optional[Tuple[Question, str, str]]:
+        """按题目ID获取 (题目, 章节, 题型)"""
+        if question_id is None:
+            return None
+        return self.bank.get_by_id(question_id)
 
-    def _format_question(self, question: Dict, q_type: str) -> str:
-        """格式化题目展示（修改多选题提示为空格分隔）"""
-        opts = "\n".join([f"{key}. {val}" for key, val in question["options"].items()])
-        # 多选题提示改为空格分隔
-        tips = "（多选题，请用 A B 格式作答）" if q_type == "multiple" else "（单选题）"
-        return f"{question['question']}\n{opts}\n{tips}"
+    def _prepare_question(self, question: Question, q_type: str) -> Tuple[str, FrozenSet[str], str]:
+        """获取题目加载时生成的 (展示文本, 正确答案集合, 正确答案展示文本)"""
+        return question.rendered, question.key, question.answer
+
+    def _grade_answer(self, reply: str, answer_key: FrozenSet[str]) -> bool:
+        """统一判题：把作答解析为选项集合后与正确答案比较"""
+        started = time.perf_counter()
+        is_correct = parse_answer(reply) == answer_key
+        self.metrics.observe("shuati_grade_seconds", time.perf_counter() - started, mode="single")
+        self.metrics.inc("shuati_answers_total", result="correct" if is_correct else "wrong")
+        return is_correct
 
     def _get_user_data(self, user_id: str) -> Dict:
-        """获取用户数据（从缓存或文件加载）"""
-        if user_id in self.user_data:
-            return self.user_data[user_id]
-        
-        user_data_path = os.path.join(USER_DATA_DIR, f"{user_id}.json")
-        if os.path.exists(user_data_path):
-            try:
-                with open(user_data_path, encoding="utf-8") as f:
-                    data = json.load(f)
-                    self.user_data[user_id] = data
-                    return data
-            except Exception as e:
-                logger.error(f"加载用户 {user_id} 数据时出错: {e}")
-        
-        # 初始化用户数据
-        self.user_data[user_id] = {
-            "wrong_questions": [],
+        """获取用户数据（从缓存、待写队列或存储加载）"""
+        self.user_data.expire()
+        data = self.user_data.get(user_id)
+        if data is not None:
+            return data
+
+        # 已被淘汰但尚未写盘的数据比存储中的更新
+        data = self.writer.get_pending(user_id)
+        if data is None:
+            data = self.store.load(user_id)
+        if data is None:
+            data = self._new_user_data()
+        elif self._upgrade_wrong_book(data):
+            self.writer.mark_dirty(user_id, data)
+        self.user_data.put(user_id, data)
+        return data
+
+    @staticmethod
+    def _new_user_data() -> Dict:
+        """初始化用户数据"""
+        return {
+            "wrong_questions": {},  # 题目ID -> {"miss": 答错次数, "last": 最近答错时间, "box": 复习盒子, "due": 下次复习时间}
             "total_questions": 0,
             "correct_questions": 0,
-            "showed_50_wrong_tip": False
+            "showed_50_wrong_tip": False,
+            "decks": {},  # 章节 -> [排列种子, 已抽张数, 题目数]，随机刷题按此不重复抽题
+            "order_positions": {},  # 章节 -> 顺序刷题下次继续的题目序号
         }
-        return self.user_data[user_id]
+
+    def _upgrade_wrong_book(self, data: Dict) -> bool:
+        """把旧版错题本（完整题目副本列表）转换为按题目ID引用的形式，返回是否有改动"""
+        book = data.get("wrong_questions")
+        if isinstance(book, list):
+            entries = [(entry.get("id"), entry) for entry in book]
+        elif isinstance(book, dict) and any("question" in meta for meta in book.values()):
+            entries = list(book.items())
+        else:
+            return False
+
+        now = int(time.time())
+        upgraded: Dict[str, Dict] = {}
+        for question_id, entry in entries:
+            question_id = self._resolve_legacy_question_id(question_id, entry)
+            if question_id is None:
+                logger.warning(f"错题本中的题目在题库中找不到，已移除: {str(entry.get('question', ''))[:20]}...")
+                continue
+            meta = upgraded.setdefault(question_id, {"miss": 0, "last": now})
+            meta["miss"] += 1
+        data["wrong_questions"] = upgraded
+        return True
+
+    def _resolve_legacy_question_id(self, question_id, entry: Dict) -> Optional[str]:
+        """旧版错题可能带有随机生成的临时ID或与其他章节重复的ID，先按ID、再按题干匹配题库
+
+        条目带有题干时，只有题库中该ID的题干与之相同才按ID匹配，否则按题干查找。
+        """
+        text = entry.get("question")
+        if question_id is not None:
+            found = self.bank.get_by_id(question_id)
+            if found is not None and (not text or found[0].text == text):
+                return str(question_id)
+        if not text:
+            return None
+        if self._question_ids_by_text is None:
+            self._question_ids_by_text = {q.text: qid for qid, q, _, _ in self.bank.iter_questions()}
+        return self._question_ids_by_text.get(text)
+
+    def _compact_user_data(self):
+        """一次性整理：把存储中所有旧格式的用户数据改写为新格式"""
+        if self.store.get_format_version() >= USER_DATA_FORMAT_VERSION:
+            return
+        compacted = 0
+        for user_id in self.store.iter_user_ids():
+            data = self.store.load(user_id)
+            if data is not None and self._upgrade_wrong_book(data):
+                try:
+                    self.store.write_sync(user_id, data)
+                    compacted += 1
+                except Exception as e:
+                    logger.error(f"整理用户 {user_id} 数据时出错: {e}")
+                    return
+        self.store.set_format_version(USER_DATA_FORMAT_VERSION)
+        self._question_ids_by_text = None
+        logger.info(f"用户数据整理完成，共改写 {compacted} 个用户的错题本")
+
+    def _on_user_evicted(self, user_id: str, data: Dict):
+        """用户移出缓存时释放复习堆，若有未保存的修改则尽快写盘"""
+        self.scheduler.forget(user_id)
+        if self.writer.get_pending(user_id) is not None:
+            self.writer.request_flush()
 
     def _save_user_data(self, user_id: str):
-        """保存用户数据到文件"""
-        if user_id not in self.user_data:
+        """标记用户数据待保存（由后台任务批量写盘）"""
+        data = self.user_data.peek(user_id)
+        if data is None:
             return
-        
-        user_data_path = os.path.join(USER_DATA_DIR, f"{user_id}.json")
-        try:
-            with open(user_data_path, "w", encoding="utf-8") as f:
-                json.dump(self.user_data[user_id], f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"保存用户 {user_id} 数据时出错: {e}")
+        self.metrics.inc("shuati_save_requests_total")
+        self.writer.mark_dirty(user_id, data)
 
-    def _add_wrong_question(self, user_id: str, question: Dict, chapter: str, q_type: str, event: AstrMessageEvent):
-        """添加错题到用户错题本（新增50题检测）"""
-        user_data = self._get_user_data(user_id)
-        # 检查是否已存在该错题（避免重复添加）
-        question_id = question.get("id", None)
-        if question_id:
-            existing = [q for q in user_data["wrong_questions"] if q.get("id") == question_id]
-            if existing:
-                return
-        
-        # 添加错题
-        wrong_question = {
-            "chapter": chapter,
-            "type": q_type,
-            "question": question["question"],
-            "options": question["options"],
-            "answer": question["answer"],
-            "id": question.get("id", random.randint(1000, 9999))  # 生成临时ID
-        }
-        user_data["wrong_questions"].append(wrong_question)
+    def _record_wrong_question(self, user_id: str, user_data: Dict, question_id: str, now: int) -> bool:
+        """在错题本中记录一次答错（不触发保存），返回是否为新加入的错题"""
+        wrong_questions = user_data["wrong_questions"]
+        # 已存在的错题只更新答错次数和时间，并重新从第一个复习盒子开始
+        meta = wrong_questions.get(question_id)
+        if meta is not None:
+            meta["miss"] = meta.get("miss", 0) + 1
+            meta["last"] = now
+            self.scheduler.schedule_new(user_id, wrong_questions, question_id, now)
+            return False
+
+        wrong_questions[question_id] = {"miss": 1, "last": now}
+        self.scheduler.schedule_new(user_id, wrong_questions, question_id, now)
         user_data["total_questions"] += 1
-        
-        # 检测错题数量是否达到50且未提示
-        if len(user_data["wrong_questions"]) == 50 and not user_data["showed_50_wrong_tip"]:
-            user_name = event.get_sender_name()
-            tips = f"📢 {user_name}，你的错题集已累计50道题！\n立即使用 /wrong 开始针对性复习吧～"
-            event.send(event.plain_result(tips))  # 发送提醒消息
+        return True
+
+    @staticmethod
+    def _take_wrong_tip(user_data: Dict, user_name: str) -> Optional[str]:
+        """错题数量达到50且未提示过时返回提醒消息，并标记已提示"""
+        if len(user_data["wrong_questions"]) >= 50 and not user_data["showed_50_wrong_tip"]:
             user_data["showed_50_wrong_tip"] = True  # 标记已提示
-        
-        self._save_user_data(user_id)
-        logger.info(f"用户 {user_id} 添加错题: {question['question'][:20]}...")
+            return f"📢 {user_name}，你的错题集已累计50道题！\n立即使用 /wrong 开始针对性复习吧～"
+        return None
 
-    def _get_random_wrong_question(self, user_id: str) -> Optional[Tuple[Dict, str, str]]:
-        """从用户错题本中随机获取一道错题"""
+    async def _add_wrong_question(self, user_id: str, question: Question, chapter: str, q_type: str, event: AstrMessageEvent):
+        """添加错题到用户错题本（新增50题检测）"""
+        tips = None
+        async with self.user_locks(user_id):
+            user_data = self._get_user_data(user_id)
+            if self._record_wrong_question(user_id, user_data, question.id, int(time.time())):
+                tips = self._take_wrong_tip(user_data, event.get_sender_name())
+                logger.info(f"用户 {user_id} 添加错题: {question.text[:20]}...")
+            self._save_user_data(user_id)
+        # 在锁外发送消息，避免平台发送慢时阻塞同一段的其他用户
+        if tips:
+            await event.send(event.plain_result(tips))
+
+    def _get_next_wrong_question(self, user_id: str) -> Optional[Tuple[Question, str, str]]:
+        """从用户错题本中取出最该复习（到期最早）的一道错题"""
         user_data = self._get_user_data(user_id)
         wrong_questions = user_data["wrong_questions"]
-        
-        if not wrong_questions:
-            return None
-        
-        question = random.choice(wrong_questions)
-        chapter = question["chapter"]
-        q_type = question["type"]
-        return question, chapter, q_type
+
+        while True:
+            question_id = self.scheduler.peek(user_id, wrong_questions)
+            if question_id is None:
+                return None
+            indexed = self._get_question_by_id(question_id)
+            if indexed:
+                return indexed
+            # 题库中已删除的题目直接移出错题本
+            del wrong_questions[question_id]
+            self._save_user_data(user_id)
+
+    def _format_chapter_line(self, index: int, title: str) -> str:
+        """章节列表中的一行：编号、标题和各题型题目数（只读目录，不解码章节）"""
+        counts = self.bank.counts(title)
+        return f"{index}. {title}（单选 {counts.get('single', 0)} 题，多选 {counts.get('multiple', 0)} 题）"
+
+    @staticmethod
+    def _format_interval(seconds: float) -> str:
+        """把秒数格式化为“x分钟/x小时/x天”"""
+        if seconds < 3600:
+            return f"{max(1, round(seconds / 60))}分钟"
+        if seconds < 86400:
+            return f"{round(seconds / 3600)}小时"
+        return f"{round(seconds / 86400)}天"
 
     @filter.command("shuati")
-    async def start_quiz(self, event: AstrMessageEvent, arg: Union[str, int, None] = None):
-        """启动刷题模式（支持章节选择）"""
+    @timed_command("shuati")
+    async def start_quiz(self, event: AstrMessageEvent, arg: Union[str, int, None] = None, count: Union[int, None] = None):
+        """启动刷题模式（支持章节选择；第二个参数为题数时进入批量刷题）"""
         user_id = event.get_sender_id()
         user_name = event.get_sender_name()
 
@@ -181,7 +498,7 @@ class ShuatiPlugin(Star):
 
         if isinstance(arg, str) and arg.lower() in ["list", "错题本", "wrong"]:
             if arg.lower() == "list":
-                lines = [f"{i}. {name}" for i, name in enumerate(self.chapter_keys)]
+                lines = [self._format_chapter_line(i, name) for i, name in enumerate(self.bank.chapter_keys)]
                 yield event.plain_result("📚 可用章节列表：\n" + "\n".join(lines))
             elif arg.lower() in ["错题本", "wrong"]:
                 await self._show_or_practice_wrong_questions(event, user_id, user_name, show_only=True)
@@ -193,55 +510,138 @@ class ShuatiPlugin(Star):
             yield event.plain_result("章节编号无效，请输入 /shuati list 查看章节编号。")
             return
 
-        if chapter_index >= len(self.chapter_keys):
+        if chapter_index >= len(self.bank.chapter_keys):
             yield event.plain_result("章节编号超出范围，请输入 /shuati list 查看章节编号。")
             return
 
-        chapter = self.chapter_keys[chapter_index]
-        question, q_type = self._get_random_question(chapter)
-        if not question:
-            yield event.plain_result("未找到该章节的题目。")
+        chapter = self.bank.chapter_keys[chapter_index]
+        if count is not None:
+            try:
+                count = int(count)
+            except (ValueError, TypeError):
+                yield event.plain_result(f"题数无效，批量刷题的题数需在 2-{BATCH_MAX_QUESTIONS} 之间。")
+                return
+        if count is not None and count != 1:
+            if not 1 < count <= BATCH_MAX_QUESTIONS:
+                yield event.plain_result(f"批量刷题的题数需在 2-{BATCH_MAX_QUESTIONS} 之间。")
+                return
+            await self._start_batch_quiz(event, user_id, chapter, count)
             return
 
-        await event.send(event.plain_result(f"📖 当前章节：{chapter}\n" + self._format_question(question, q_type)))
+        if not self.bank.size(chapter):
+            yield event.plain_result("未找到该章节的题目。")
+            return
+        if not await self._open_session(event, user_id):
+            return
 
         @session_waiter(timeout=90)
         async def wait_answer(controller: SessionController, ev: AstrMessageEvent):
-            user_answer = ev.message_str.strip().upper().replace("，", " ")  # 统一替换为空格
-            is_correct = False
-
-            if q_type == "single":
-                is_correct = user_answer == question["answer"]
-            elif q_type == "multiple":
-                correct = set(question["answer"])
-                # 用空格分割答案
-                given = set([x.strip() for x in user_answer.split() if x.strip()])
-                is_correct = given == correct
+            is_correct = self._grade_answer(ev.message_str, answer_key)
+            self.analytics.record(user_id, ev.get_sender_name(), chapter, question.id, is_correct)
 
             if is_correct:
                 await ev.send(ev.plain_result("✅ 回答正确！"))
-                user_data = self._get_user_data(user_id)
-                user_data["correct_questions"] += 1
-                self._save_user_data(user_id)
+                async with self.user_locks(user_id):
+                    user_data = self._get_user_data(user_id)
+                    user_data["correct_questions"] += 1
+                    self._save_user_data(user_id)
             else:
-                # 多选题正确答案用空格连接展示
-                correct_ans = " ".join(question["answer"]) if q_type == "multiple" else question["answer"]
-                await ev.send(ev.plain_result(f"❌ 回答错误，正确答案是: {correct_ans}"))
+                await ev.send(ev.plain_result(f"❌ 回答错误，正确答案是: {correct_text}"))
                 # 添加错题到错题本（传递event参数）
-                self._add_wrong_question(user_id, question, chapter, q_type, ev)
+                await self._add_wrong_question(user_id, question, chapter, q_type, ev)
             
             # 无论回答正确与否，处理完后立即终止会话
             controller.stop()
 
         try:
-            await wait_answer(event)
+            # 抽题也放在 try 中，出错时同样释放会话名额
+            question, q_type = (await self._draw_questions(user_id, chapter, 1))[0]
+            question_text, answer_key, correct_text = self._prepare_question(question, q_type)
+            await event.send(event.plain_result(f"📖 当前章节：{chapter}\n" + question_text))
+            await self._wait_session(wait_answer, event)
+        except TimeoutError:
+            yield event.plain_result("⏰ 作答超时，已退出刷题模式。")
         except Exception as e:
             logger.error(f"答题时出错: {e}")
             yield event.plain_result("发生错误或超时，已退出刷题模式。")
+        finally:
+            self.session_limiter.release(user_id)
+
+    async def _start_batch_quiz(self, event: AstrMessageEvent, user_id: str, chapter: str, count: int):
+        """批量刷题：一次发出多道题，在一条回复中作答（如 1A 2BD 3C）并统一批改"""
+        if not self.bank.size(chapter):
+            await event.send(event.plain_result("未找到该章节的题目。"))
+            return
+        if not await self._open_session(event, user_id):
+            return
+
+        total = min(count, self.bank.size(chapter))
+
+        timeout = 90 + BATCH_SECONDS_PER_QUESTION * total
+
+        @session_waiter(timeout=timeout)
+        async def wait_batch_answer(controller: SessionController, ev: AstrMessageEvent):
+            started = time.perf_counter()
+            answers = parse_batch_answers(ev.message_str)
+            if not answers:
+                await ev.send(ev.plain_result("没有识别到答案，请按“题号+选项”作答，如：1A 2BD 3C"))
+                controller.keep(timeout=timeout, reset_timeout=True)
+                return
+
+            now = int(time.time())
+            user_name = ev.get_sender_name()
+            correct_count = 0
+            lines = []
+            # 整批在一次加锁中更新、保存用户数据
+            async with self.user_locks(user_id):
+                user_data = self._get_user_data(user_id)
+                for i, ((question, _), (_, answer_key, correct_text)) in enumerate(zip(picked, prepared), start=1):
+                    given = answers.get(i)
+                    self.analytics.record(user_id, user_name, chapter, question.id, given == answer_key)
+                    if given == answer_key:
+                        correct_count += 1
+                        continue
+                    given_text = " ".join(sorted(given)) if given else "未作答"
+                    lines.append(f"{i}. ❌ 你的答案：{given_text}，正确答案：{correct_text}")
+                    self._record_wrong_question(user_id, user_data, question.id, now)
+                user_data["correct_questions"] += correct_count
+                tips = self._take_wrong_tip(user_data, user_name)
+                self._save_user_data(user_id)
+
+            self.metrics.observe("shuati_grade_seconds", time.perf_counter() - started, mode="batch")
+            self.metrics.inc("shuati_answers_total", correct_count, result="correct")
+            self.metrics.inc("shuati_answers_total", total - correct_count, result="wrong")
+
+            msg = f"📝 批改完成：{correct_count}/{total} 正确"
+            if lines:
+                msg += "\n" + "\n".join(lines)
+            await ev.send(ev.plain_result(msg))
+            if tips:
+                await ev.send(ev.plain_result(tips))
+            controller.stop()
+
+        try:
+            # 抽题也放在 try 中，出错时同样释放会话名额
+            picked = await self._draw_questions(user_id, chapter, count)
+            prepared = [self._prepare_question(question, q_type) for question, q_type in picked]
+            for start in range(0, total, BATCH_MESSAGE_SIZE):
+                blocks = [f"{i + 1}. {prepared[i][0]}" for i in range(start, min(start + BATCH_MESSAGE_SIZE, total))]
+                header = f"📖 批量刷题 - 章节：{chapter}，共{total}题\n\n" if start == 0 else ""
+                footer = "\n\n请在一条消息中作答，如：1A 2BD 3C" if start + BATCH_MESSAGE_SIZE >= total else ""
+                await event.send(event.plain_result(header + "\n\n".join(blocks) + footer))
+            await self._wait_session(wait_batch_answer, event)
+        except TimeoutError:
+            await event.send(event.plain_result("⏰ 作答超时，已退出批量刷题模式。"))
+        except Exception as e:
+            logger.error(f"批量刷题时出错: {e}")
+            await event.send(event.plain_result("发生错误或超时，已退出批量刷题模式。"))
+        finally:
+            self.session_limiter.release(user_id)
 
     @filter.command("顺序刷题")
+    @timed_command("顺序刷题")
     async def order_quiz(self, event: AstrMessageEvent):
-        """按顺序刷题（格式：/顺序刷题 [章节编号] [题目序号]）"""
+        """按顺序刷题（格式：/顺序刷题 [章节编号] [题目序号]；省略题目序号时从上次的位置继续）"""
         user_id = event.get_sender_id()
         user_name = event.get_sender_name()
         
@@ -252,35 +652,42 @@ class ShuatiPlugin(Star):
         logger.info(f"order_quiz 原始参数: {arg_str}")
         
         if not arg_str:
-            yield event.plain_result("请输入章节编号和题目序号（格式：/顺序刷题 [章节编号] [题目序号]）。")
+            yield event.plain_result("请输入章节编号和题目序号（格式：/顺序刷题 [章节编号] [题目序号]），省略题目序号则从上次的位置继续。")
             return
         
         args = arg_str.split()
-        if len(args) != 2:
-            yield event.plain_result("参数格式错误，需输入章节编号和题目序号（如：/顺序刷题 0 5）。")
+        if len(args) not in (1, 2):
+            yield event.plain_result("参数格式错误，需输入章节编号和题目序号（如：/顺序刷题 0 5），或只输入章节编号继续上次的进度。")
             return
         
         try:
             chapter_idx = int(args[0])
-            question_idx = int(args[1])
+            question_idx = int(args[1]) if len(args) == 2 else None
         except (ValueError, TypeError):
             yield event.plain_result("章节编号和题目序号必须为数字。")
             return
         
         # 验证章节有效性
-        if chapter_idx < 0 or chapter_idx >= len(self.chapter_keys):
-            yield event.plain_result(f"章节编号无效（0-{len(self.chapter_keys)-1}），请输入 /shuati list 查看章节。")
+        if chapter_idx < 0 or chapter_idx >= len(self.bank.chapter_keys):
+            yield event.plain_result(f"章节编号无效（0-{len(self.bank.chapter_keys)-1}），请输入 /shuati list 查看章节。")
             return
         
-        chapter = self.chapter_keys[chapter_idx]
-        questions = self._get_chapter_questions(chapter)
-        if not questions:
+        chapter = self.bank.chapter_keys[chapter_idx]
+        total = self.bank.size(chapter)
+        if not total:
             yield event.plain_result(f"章节“{chapter}”下没有题目数据。")
             return
+
+        if question_idx is None:
+            # 继续模式：从上次作答的下一题开始，整章刷完后从头开始
+            question_idx = self._get_user_data(user_id).get("order_positions", {}).get(chapter, 0)
+            if question_idx >= total:
+                question_idx = 0
+                await event.send(event.plain_result(f"🎉 章节“{chapter}”已经按顺序刷完一遍，从第一题重新开始。"))
         
         # 验证题目序号有效性
-        if question_idx < 0 or question_idx >= len(questions):
-            yield event.plain_result(f"题目序号无效（0-{len(questions)-1}），该章节共有{len(questions)}道题。")
+        if question_idx < 0 or question_idx >= total:
+            yield event.plain_result(f"题目序号无效（0-{total-1}），该章节共有{total}道题。")
             return
         
         question, q_type = self._get_question_by_index(chapter, question_idx)
@@ -288,49 +695,74 @@ class ShuatiPlugin(Star):
             yield event.plain_result("获取题目失败，请重试。")
             return
         
-        await event.send(event.plain_result(f"📖 顺序刷题 - 章节：{chapter}，题目序号：{question_idx}\n" + 
-                                     self._format_question(question, q_type)))
+        question_text, answer_key, correct_text = self._prepare_question(question, q_type)
+        if not await self._open_session(event, user_id):
+            return
         
         @session_waiter(timeout=90)
         async def wait_answer(controller: SessionController, ev: AstrMessageEvent):
-            user_answer = ev.message_str.strip().upper().replace("，", " ")  # 统一替换为空格
-            is_correct = False
+            is_correct = self._grade_answer(ev.message_str, answer_key)
+            self.analytics.record(user_id, ev.get_sender_name(), chapter, question.id, is_correct)
 
-            if q_type == "single":
-                is_correct = user_answer == question["answer"]
-            elif q_type == "multiple":
-                correct = set(question["answer"])
-                given = set([x.strip() for x in user_answer.split() if x.strip()])
-                is_correct = given == correct
+            # 记录进度，下次 /顺序刷题 [章节编号] 从下一题继续
+            async with self.user_locks(user_id):
+                user_data = self._get_user_data(user_id)
+                user_data.setdefault("order_positions", {})[chapter] = question_idx + 1
+                if is_correct:
+                    user_data["correct_questions"] += 1
+                self._save_user_data(user_id)
 
             if is_correct:
                 await ev.send(ev.plain_result("✅ 回答正确！"))
-                user_data = self._get_user_data(user_id)
-                user_data["correct_questions"] += 1
-                self._save_user_data(user_id)
             else:
-                # 多选题正确答案用空格连接展示
-                correct_ans = " ".join(question["answer"]) if q_type == "multiple" else question["answer"]
-                await ev.send(ev.plain_result(f"❌ 回答错误，正确答案是: {correct_ans}"))
+                await ev.send(ev.plain_result(f"❌ 回答错误，正确答案是: {correct_text}"))
                 # 添加错题到错题本
-                self._add_wrong_question(user_id, question, chapter, q_type, ev)
+                await self._add_wrong_question(user_id, question, chapter, q_type, ev)
             
             # 无论回答正确与否，处理完后立即终止会话
             controller.stop()
 
         try:
-            await wait_answer(event)
+            await event.send(event.plain_result(f"📖 顺序刷题 - 章节：{chapter}，题目序号：{question_idx}（共{total}题）\n" + question_text))
+            await self._wait_session(wait_answer, event)
+        except TimeoutError:
+            yield event.plain_result("⏰ 作答超时，已退出顺序刷题模式。")
         except Exception as e:
             logger.error(f"顺序刷题时出错: {e}")
             yield event.plain_result("发生错误或超时，已退出顺序刷题模式。")
+        finally:
+            self.session_limiter.release(user_id)
 
     @filter.command("wrong")
+    @timed_command("wrong")
     async def practice_wrong_questions(self, event: AstrMessageEvent, arg: Union[str, None] = None):
-        """从错题本练习题目（支持查看错题列表）"""
+        """从错题本练习题目（支持查看错题列表和复习计划）"""
         user_id = event.get_sender_id()
         user_name = event.get_sender_name()
+        if arg == "due":
+            await self._show_due_wrong_questions(event, user_id, user_name)
+            return
         await self._show_or_practice_wrong_questions(event, user_id, user_name, show_only=(arg == "list"))
 
+    async def _show_due_wrong_questions(self, event: AstrMessageEvent, user_id: str, user_name: str):
+        """查看错题复习计划（按到期时间排序）"""
+        wrong_questions = self._get_user_data(user_id)["wrong_questions"]
+        if not wrong_questions:
+            await event.send(event.plain_result(f"{user_name}，你的错题本还是空的哦～继续加油刷题吧！"))
+            return
+
+        now = time.time()
+        due_count = self.scheduler.due_count(wrong_questions, now)
+        msg = f"{user_name}，错题本共{len(wrong_questions)}道题，当前待复习{due_count}道：\n"
+        for i, (due, question_id) in enumerate(self.scheduler.due_items(user_id, wrong_questions, 10)):
+            indexed = self._get_question_by_id(question_id)
+            if not indexed:
+                continue
+            q, chapter, _ = indexed
+            when = "已到期" if due <= now else f"{self._format_interval(due - now)}后"
+            msg += f"\n{i+1}. [{when}] {chapter} - {q.text[:20]}..."
+        await event.send(event.plain_result(msg))
+
     async def _show_or_practice_wrong_questions(self, event: AstrMessageEvent, user_id: str, user_name: str, show_only: bool):
         """查看错题本或从错题本练习"""
         user_data = self._get_user_data(user_id)
@@ -342,60 +774,75 @@ class ShuatiPlugin(Star):
 
         if show_only:
             # 显示错题列表（最多10条）
-            display_questions = wrong_questions[:10]
             msg = f"{user_name}，你的错题本（共{len(wrong_questions)}道题）：\n"
-            for i, q in enumerate(display_questions):
-                msg += f"\n{i+1}. {q['chapter']} - {q['question'][:20]}..."
+            for i, question_id in enumerate(islice(wrong_questions, 10)):
+                indexed = self._get_question_by_id(question_id)
+                if not indexed:
+                    continue
+                q, chapter, _ = indexed
+                msg += f"\n{i+1}. {chapter} - {q.text[:20]}..."
                 if i == 9:
                     msg += "\n（更多题目请通过练习模式查看）"
             await event.send(event.plain_result(msg))
             return
 
-        # 从错题本中随机出题
-        question_info = self._get_random_wrong_question(user_id)
+        # 从错题本中取到期最早的题目
+        question_info = self._get_next_wrong_question(user_id)
         if not question_info:
             await event.send(event.plain_result("错题本中没有题目哦～"))
             return
 
         question, chapter, q_type = question_info
-        await event.send(event.plain_result(f"📝 错题复习 - 章节：{chapter}\n" + self._format_question(question, q_type)))
+        question_text, answer_key, correct_text = self._prepare_question(question, q_type)
+        if not await self._open_session(event, user_id):
+            return
 
         @session_waiter(timeout=120)
         async def wait_review_answer(controller: SessionController, ev: AstrMessageEvent):
-            user_answer = ev.message_str.strip().upper().replace("，", " ")  # 统一替换为空格
-            is_correct = False
-
-            if q_type == "single":
-                is_correct = user_answer == question["answer"]
-            elif q_type == "multiple":
-                correct = set(question["answer"])
-                # 用空格分割答案
-                given = set([x.strip() for x in user_answer.split() if x.strip()])
-                is_correct = given == correct
+            is_correct = self._grade_answer(ev.message_str, answer_key)
 
+            question_id = question.id
+            self.analytics.record(user_id, ev.get_sender_name(), chapter, question_id, is_correct)
             if is_correct:
-                await ev.send(ev.plain_result("✅ 回答正确！这道题已经掌握啦～"))
-                # 从错题本中移除正确回答的题目
-                user_data = self._get_user_data(user_id)
-                user_data["wrong_questions"] = [q for q in user_data["wrong_questions"] if q.get("id") != question.get("id")]
-                self._save_user_data(user_id)
+                # 答对后进入下一个复习盒子，最后一个盒子再答对则移出错题本
+                async with self.user_locks(user_id):
+                    wrong_questions = self._get_user_data(user_id)["wrong_questions"]
+                    mastered = self.scheduler.record_answer(user_id, wrong_questions, question_id, True)
+                    meta = None if mastered else wrong_questions.get(question_id)
+                    self._save_user_data(user_id)
+                if meta is None:
+                    await ev.send(ev.plain_result("✅ 回答正确！这道题已经掌握啦～"))
+                else:
+                    interval = meta["due"] - time.time()
+                    await ev.send(ev.plain_result(f"✅ 回答正确！{self._format_interval(interval)}后再复习这道题～"))
             else:
-                # 多选题正确答案用空格连接展示
-                correct_ans = " ".join(question["answer"]) if q_type == "multiple" else question["answer"]
-                await ev.send(ev.plain_result(f"❌ 回答错误，正确答案是: {correct_ans}，需要继续复习哦～"))
-                # 添加错题到错题本（传递event参数）
-                self._add_wrong_question(user_id, question, chapter, q_type, ev)
+                await ev.send(ev.plain_result(f"❌ 回答错误，正确答案是: {correct_text}，需要继续复习哦～"))
+                # 答错后回到第一个复习盒子（已被移出错题本时重新加入）
+                async with self.user_locks(user_id):
+                    wrong_questions = self._get_user_data(user_id)["wrong_questions"]
+                    reviewed = question_id in wrong_questions
+                    if reviewed:
+                        self.scheduler.record_answer(user_id, wrong_questions, question_id, False)
+                        self._save_user_data(user_id)
+                if not reviewed:
+                    await self._add_wrong_question(user_id, question, chapter, q_type, ev)
             
             # 无论回答正确与否，处理完后立即终止会话
             controller.stop()
 
         try:
-            await wait_review_answer(event)
+            await event.send(event.plain_result(f"📝 错题复习 - 章节：{chapter}\n" + question_text))
+            await self._wait_session(wait_review_answer, event)
+        except TimeoutError:
+            await event.send(event.plain_result("⏰ 作答超时，已退出错题复习模式。"))
         except Exception as e:
             logger.error(f"错题复习时出错: {e}")
             await event.send(event.plain_result("发生错误或超时，已退出错题复习模式。"))
+        finally:
+            self.session_limiter.release(user_id)
 
     @filter.command("stats")
+    @timed_command("stats")
     async def show_statistics(self, event: AstrMessageEvent):
         """显示刷题统计数据"""
         user_id = event.get_sender_id()
@@ -415,35 +862,147 @@ class ShuatiPlugin(Star):
         
         yield event.plain_result(msg)
     
+    def _parse_chapter_arg(self, arg: Union[str, int, None]) -> Tuple[Optional[str], Optional[str]]:
+        """解析可选的章节编号参数，返回 (章节名, 错误提示)，未指定章节时章节名为 None"""
+        if arg is None:
+            return None, None
+        try:
+            chapter_index = int(arg)
+        except (ValueError, TypeError):
+            return None, "章节编号无效，请输入 /shuati list 查看章节编号。"
+        if chapter_index < 0 or chapter_index >= len(self.bank.chapter_keys):
+            return None, "章节编号超出范围，请输入 /shuati list 查看章节编号。"
+        return self.bank.chapter_keys[chapter_index], None
+
+    @filter.command("排行")
+    @timed_command("排行")
+    async def show_leaderboard(self, event: AstrMessageEvent, arg: Union[str, int, None] = None):
+        """正确率排行榜（可指定章节编号）"""
+        chapter, error = self._parse_chapter_arg(arg)
+        if error:
+            yield event.plain_result(error)
+            return
+
+        top = self.analytics.top_users(chapter, RANK_SIZE, RANK_MIN_ANSWERS)
+        scope = f"章节“{chapter}”" if chapter else "全部章节"
+        if not top:
+            yield event.plain_result(f"{scope}还没有作答满{RANK_MIN_ANSWERS}题的同学，快来刷题上榜吧！")
+            return
+
+        msg = f"🏆 {scope}正确率排行（至少作答{RANK_MIN_ANSWERS}题）：\n"
+        for i, (user_id, attempts, correct) in enumerate(top):
+            name = self.analytics.names.get(user_id, user_id)
+            msg += f"\n{i+1}. {name} - {correct / attempts * 100:.1f}%（{correct}/{attempts}）"
+        yield event.plain_result(msg)
+
+    @filter.command("难题")
+    @timed_command("难题")
+    async def show_hard_questions(self, event: AstrMessageEvent, arg: Union[str, int, None] = None):
+        """全体用户错误率最高的题目（可指定章节编号）"""
+        chapter, error = self._parse_chapter_arg(arg)
+        if error:
+            yield event.plain_result(error)
+            return
+
+        hardest = self.analytics.hardest_questions(chapter, RANK_SIZE, HARD_QUESTION_MIN_ANSWERS,
+                                                   exists=self.bank.__contains__)
+        scope = f"章节“{chapter}”" if chapter else "全部章节"
+        if not hardest:
+            yield event.plain_result(f"{scope}还没有作答满{HARD_QUESTION_MIN_ANSWERS}次的题目。")
+            return
+
+        msg = f"🔥 {scope}错误率最高的题目（至少作答{HARD_QUESTION_MIN_ANSWERS}次）：\n"
+        for i, (question_chapter, question_id, attempts, errors) in enumerate(hardest):
+            indexed = self._get_question_by_id(question_id)
+            if not indexed:
+                continue
+            q, _, _ = indexed
+            msg += f"\n{i+1}. [{errors / attempts * 100:.0f}%错误，{errors}/{attempts}] {question_chapter} - {q.text[:20]}..."
+        yield event.plain_result(msg)
+
+    @filter.command("搜题")
+    @timed_command("搜题")
+    async def search_questions(self, event: AstrMessageEvent):
+        """按关键词搜索题目（格式：/搜题 [关键词]），返回章节编号和题目序号"""
+        # 从原始消息中提取关键词（跳过命令部分），关键词中可以有空格
+        command_prefix = "搜题"
+        keyword = event.message_str.strip().lstrip("/")
+        if keyword.startswith(command_prefix):
+            keyword = keyword[len(command_prefix):].strip()
+        if not keyword:
+            yield event.plain_result("请输入关键词（格式：/搜题 [关键词]），如：/搜题 实事求是")
+            return
+
+        results = self._get_search_index().search(keyword, SEARCH_RESULT_LIMIT)
+        if not results:
+            yield event.plain_result(f"没有找到包含“{keyword}”的题目，换个关键词试试吧～")
+            return
+
+        msg = f"🔍 “{keyword}”的搜索结果（章节编号-题目序号）：\n"
+        for chapter_idx, question_idx, question_id in results:
+            indexed = self._get_question_by_id(question_id)
+            if not indexed:
+                continue
+            q, _, _ = indexed
+            msg += f"\n[{chapter_idx}-{question_idx}] {q.text[:30]}..."
+        msg += "\n\n使用 /顺序刷题 [章节编号] [题目序号] 直接作答"
+        yield event.plain_result(msg)
+
+    @filter.command("shuati_metrics")
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @timed_command("shuati_metrics")
+    async def show_metrics(self, event: AstrMessageEvent):
+        """查看插件运行指标（仅管理员）"""
+        yield event.plain_result("📈 刷题插件运行指标：\n" + self.metrics.render_summary())
+
     @filter.command("刷题帮助")
+    @timed_command("刷题帮助")
     async def show_help(self, event: AstrMessageEvent):
         """显示刷题插件帮助信息"""
         help_msg = """
         📚 刷题插件帮助指南 📚
         
         一、插件基本逻辑
-        1. 支持按章节随机刷题和顺序刷题
-        2. 单选题直接输入选项（如A），多选题用空格分隔选项（如A B）
-        3. 错题本支持针对性复习，答对后自动移除已掌握题目
+        1. 支持按章节随机刷题和顺序刷题，随机刷题在整章出完之前不会重复出题
+        2. 单选题直接输入选项（如A），多选题输入全部选项（如A B、A,B 或 AB）
+        3. 错题本按间隔重复安排复习，每次优先出到期最早的题，连续答对到最后一轮后自动移除
         
         二、常用指令
         /shuati [章节编号]       开始指定章节随机刷题
+        /shuati [章节编号] [题数] 批量刷题，一条消息作答（如 1A 2BD 3C）
         /顺序刷题 [章节编号] [题目序号] 按顺序刷指定章节的题目
+        /顺序刷题 [章节编号]     从上次的位置继续顺序刷题
         /shuati list            查看所有可用章节
         /wrong                  从错题本练习
         /wrong list             查看错题列表
+        /wrong due              查看错题复习计划
         /stats                  查看刷题统计数据
+        /搜题 [关键词]           按关键词查找题目
+        /排行 [章节编号]         查看正确率排行榜
+        /难题 [章节编号]         查看大家错得最多的题目
         
         三、顺序刷题说明
         1. 格式：/顺序刷题 [章节编号] [题目序号]
         2. 章节编号从0开始，可通过 /shuati list 查看
         3. 题目序号从0开始，代表章节内题目的存储顺序
         4. 若题目序号超出范围，将提示该章节的题目总数
+        5. 省略题目序号时从上次作答的下一题继续，整章刷完后从头开始
         """
         yield event.plain_result(help_msg.strip())
 
     async def terminate(self):
-        """插件卸载时保存所有用户数据"""
-        for user_id in self.user_data:
-            self._save_user_data(user_id)
-        logger.info("Shuati 插件已卸载，用户数据已保存")
\ No newline at end of file
+        """插件卸载时写入所有待保存的用户数据"""
+        if self._reload_task is not None:
+            self._reload_task.cancel()
+        if self._metrics_task is not None:
+            self._metrics_task.cancel()
+        if self._checkpoint_task is not None:
+            self._checkpoint_task.cancel()
+        try:
+            await self.analytics.checkpoint()
+        except Exception as e:
+            logger.error(f"保存答题统计时出错: {e}")
+        await self.writer.close()
+        self.store.close()
+        self.bank.close()
+        logger.info(f"Shuati 插件已卸载，用户数据已保存，缓存统计: {self.user_data.stats()}")
\ No newline at end of file
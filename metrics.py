@@ -0,0 +1,193 @@
+import time
+import inspect
+import functools
+import contextvars
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# 延迟直方图的桶上界（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 指标名 -> (类型, 说明)
+METRIC_HELP = {
+    "shuati_commands_total": ("counter", "处理的命令数"),
+    "shuati_command_seconds": ("histogram", "命令处理耗时（不含等待用户作答的时间）"),
+    "shuati_answers_total": ("counter", "批改的作答数"),
+    "shuati_grade_seconds": ("histogram", "单次批改耗时"),
+    "shuati_session_timeouts_total": ("counter", "答题会话超时次数"),
+    "shuati_session_errors_total": ("counter", "答题会话异常次数"),
+    "shuati_session_rejected_total": ("counter", "因超出每个用户的会话数上限而拒绝的答题次数"),
+    "shuati_active_sessions": ("gauge", "进行中的答题会话数"),
+    "shuati_save_requests_total": ("counter", "标记用户数据待保存的次数"),
+    "shuati_save_seconds": ("histogram", "单个用户数据写盘耗时"),
+    "shuati_save_bytes_total": ("counter", "写入用户数据的字节数"),
+    "shuati_save_errors_total": ("counter", "用户数据写盘失败次数"),
+    "shuati_event_loop_lag_seconds": ("histogram", "事件循环调度延迟"),
+    "shuati_user_cache_hits_total": ("counter", "用户数据缓存命中次数"),
+    "shuati_user_cache_misses_total": ("counter", "用户数据缓存未命中次数"),
+    "shuati_user_cache_evictions_total": ("counter", "用户数据缓存淘汰次数"),
+    "shuati_user_cache_size": ("gauge", "缓存中的用户数"),
+    "shuati_save_pending": ("gauge", "等待写盘的用户数"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """固定桶的累积直方图"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个是 +Inf 桶
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """按桶估算分位数（返回所在桶的上界）"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metrics:
+    """进程内指标：计数器、直方图，以及渲染时才采集的外部数值"""
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        # 采集函数返回 [(指标名, 标签, 数值)]，用于缓存统计等已在别处计数的数据
+        self._collectors: List[Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]] = []
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram()
+        hist.observe(value)
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]):
+        self._collectors.append(collector)
+
+    def _collected(self) -> Dict[Tuple[str, Labels], float]:
+        values = {}
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                values[(name, _labels(labels))] = value
+        return values
+
+    def render_prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        samples: Dict[str, List[str]] = {}
+        for (name, labels), value in list(self.counters.items()) + list(self._collected().items()):
+            samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), hist in self.histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, n in zip(hist.buckets + (float("inf"),), hist.counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                le_label = f'le="{le}"'
+                lines.append(f"{name}_bucket{_format_labels(labels, le_label)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+
+        out = []
+        for name in sorted(samples):
+            metric_type, help_text = METRIC_HELP.get(name, ("untyped", name))
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {metric_type}")
+            out.extend(samples[name])
+        return "\n".join(out) + "\n"
+
+    def render_summary(self) -> str:
+        """给管理员看的简要文本：计数器数值和各直方图的次数、平均值、p50/p99"""
+        lines = []
+        for (name, labels), value in sorted(list(self.counters.items()) + list(self._collected().items())):
+            lines.append(f"{name}{_format_labels(labels)} = {value:g}")
+        for (name, labels), hist in sorted(self.histograms.items(), key=lambda item: item[0]):
+            mean = hist.sum / hist.count * 1000 if hist.count else 0.0
+            lines.append(
+                f"{name}{_format_labels(labels)}: {hist.count}次，平均{mean:.2f}ms，"
+                f"p50≤{hist.quantile(0.5) * 1000:g}ms，p99≤{hist.quantile(0.99) * 1000:g}ms"
+            )
+        return "\n".join(lines)
+
+
+# 当前命令中等待用户作答所花的时间，计算命令处理耗时时扣除
+_session_wait: contextvars.ContextVar[list] = contextvars.ContextVar("shuati_session_wait")
+
+
+def add_session_wait(seconds: float):
+    """记录一段等待用户作答的时间（在 timed_command 包装的命令中调用）"""
+    wait = _session_wait.get(None)
+    if wait is not None:
+        wait[0] += seconds
+
+
+def _reset(token: contextvars.Token):
+    try:
+        _session_wait.reset(token)
+    except ValueError:  # 异步生成器被垃圾回收时可能在其他上下文中结束
+        pass
+
+
+def timed_command(command: str):
+    """统计命令次数和处理耗时的装饰器（需放在 filter.command 之下），保留原函数签名和类型"""
+    def decorator(func):
+        def record(self, started: float, wait: list):
+            self.metrics.inc("shuati_commands_total", command=command)
+            self.metrics.observe("shuati_command_seconds", time.perf_counter() - started - wait[0], command=command)
+
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def wrapper(self, *args, **kwargs):
+                wait = [0.0]
+                token = _session_wait.set(wait)
+                started = time.perf_counter()
+                try:
+                    async for result in func(self, *args, **kwargs):
+                        yield result
+                finally:
+                    record(self, started, wait)
+                    _reset(token)
+        else:
+            @functools.wraps(func)
+            async def wrapper(self, *args, **kwargs):
+                wait = [0.0]
+                token = _session_wait.set(wait)
+                started = time.perf_counter()
+                try:
+                    return await func(self, *args, **kwargs)
+                finally:
+                    record(self, started, wait)
+                    _reset(token)
+        return wrapper
+    return decorator
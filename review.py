@@ -0,0 +1,86 @@
+import time
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+# Leitner 盒子：第 i 个盒子答对后间隔多久（秒）再复习；最后一个盒子再答对即视为掌握
+LEITNER_INTERVALS = [5 * 60, 30 * 60, 24 * 3600, 3 * 24 * 3600, 7 * 24 * 3600]
+
+
+class ReviewScheduler:
+    """错题复习调度（Leitner 间隔重复），每个用户一个按到期时间排序的最小堆
+
+    错题元数据中记录 box（所在盒子）和 due（到期时间戳）。堆中的条目采用惰性删除：
+    到期时间被更新或题目已移出错题本后，旧条目留在堆里，取堆顶时再丢弃。
+    """
+
+    def __init__(self):
+        self._heaps: Dict[str, List[Tuple[int, str]]] = {}
+
+    def _get_heap(self, user_id: str, book: Dict[str, Dict]) -> List[Tuple[int, str]]:
+        heap = self._heaps.get(user_id)
+        # 过期条目过多时重建，避免堆无限增长
+        if heap is None or len(heap) > 2 * len(book) + 16:
+            heap = [(meta.get("due", 0), question_id) for question_id, meta in book.items()]
+            heapq.heapify(heap)
+            self._heaps[user_id] = heap
+        return heap
+
+    @staticmethod
+    def _is_live(item: Tuple[int, str], book: Dict[str, Dict]) -> bool:
+        meta = book.get(item[1])
+        return meta is not None and meta.get("due", 0) == item[0]
+
+    def peek(self, user_id: str, book: Dict[str, Dict]) -> Optional[str]:
+        """返回最该复习（到期时间最早）的题目ID，错题本为空时返回 None"""
+        heap = self._get_heap(user_id, book)
+        while heap and not self._is_live(heap[0], book):
+            heapq.heappop(heap)
+        return heap[0][1] if heap else None
+
+    def schedule_new(self, user_id: str, book: Dict[str, Dict], question_id: str, now: Optional[int] = None):
+        """题目新加入错题本或再次答错：放回第一个盒子"""
+        now = int(now if now is not None else time.time())
+        meta = book[question_id]
+        meta["box"] = 0
+        meta["due"] = now + LEITNER_INTERVALS[0]
+        self._push(user_id, book, question_id)
+
+    def record_answer(self, user_id: str, book: Dict[str, Dict], question_id: str, correct: bool) -> bool:
+        """复习作答后更新间隔，返回该题是否已掌握（已从错题本移除）"""
+        meta = book.get(question_id)
+        if meta is None:
+            return False
+        now = int(time.time())
+        if not correct:
+            meta["miss"] = meta.get("miss", 0) + 1
+            meta["last"] = now
+            self.schedule_new(user_id, book, question_id, now)
+            return False
+
+        box = meta.get("box", 0) + 1
+        if box >= len(LEITNER_INTERVALS):
+            del book[question_id]
+            return True
+        meta["box"] = box
+        meta["due"] = now + LEITNER_INTERVALS[box]
+        self._push(user_id, book, question_id)
+        return False
+
+    def due_items(self, user_id: str, book: Dict[str, Dict], limit: int = 10) -> List[Tuple[int, str]]:
+        """按到期时间返回前 limit 道题的 (到期时间, 题目ID)"""
+        heap = self._get_heap(user_id, book)
+        return heapq.nsmallest(limit, (item for item in heap if self._is_live(item, book)))
+
+    @staticmethod
+    def due_count(book: Dict[str, Dict], now: Optional[float] = None) -> int:
+        now = now if now is not None else time.time()
+        return sum(1 for meta in book.values() if meta.get("due", 0) <= now)
+
+    def _push(self, user_id: str, book: Dict[str, Dict], question_id: str):
+        heap = self._heaps.get(user_id)
+        if heap is not None:
+            heapq.heappush(heap, (book[question_id]["due"], question_id))
+
+    def forget(self, user_id: str):
+        """用户移出缓存时释放其堆"""
+        self._heaps.pop(user_id, None)
@@ -0,0 +1,127 @@
+import re
+import math
+import heapq
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from .bank import Question, QuestionBank
+
+# 连续的汉字、字母或数字，其余字符（标点、空白）作为分隔
+_WORD_RUN = re.compile(r"[0-9a-z\u3400-\u4dbf\u4e00-\u9fff]+")
+# 题干中的词比选项中的词权重更高
+STEM_WEIGHT = 2
+OPTION_WEIGHT = 1
+# 多字关键词至少要命中这一比例的二元组才算匹配
+MIN_MATCH_RATIO = 0.6
+
+
+def tokenize(text: str) -> List[str]:
+    """把文本切成字符二元组（全角转半角、字母转小写，不跨标点）；只有一个字的片段保留为单字"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for run in _WORD_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class ChapterIndex:
+    """单个章节的倒排索引：二元组 -> {题目序号: 权重}
+
+    单字查询没有对应的二元组，按包含该字的所有二元组合并（见 lookup），合并结果按字缓存。
+    """
+
+    __slots__ = ("title", "source", "question_ids", "postings", "chars")
+
+    def __init__(self, title: str, source: str, questions: List[Tuple[Question, str]]):
+        self.title = title
+        self.source = source
+        self.question_ids: List[str] = []
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.chars: Dict[str, Dict[int, int]] = {}
+        for seq, (question, _) in enumerate(questions):
+            self.question_ids.append(question.id)
+            self._add(seq, question.text, STEM_WEIGHT)
+            for option in question.options:
+                self._add(seq, option, OPTION_WEIGHT)
+
+    def _add(self, seq: int, text: str, weight: int):
+        for token in tokenize(text):
+            docs = self.postings.setdefault(token, {})
+            if docs.get(seq, 0) < weight:
+                docs[seq] = weight
+
+    def lookup(self, token: str) -> Dict[int, int]:
+        """查询词元的 {题目序号: 权重}；单字匹配所有包含它的二元组（以及单字片段）"""
+        if len(token) > 1:
+            return self.postings.get(token, {})
+        docs = self.chars.get(token)
+        if docs is None:
+            docs = {}
+            for key, key_docs in self.postings.items():
+                if token in key:
+                    for seq, weight in key_docs.items():
+                        if docs.get(seq, 0) < weight:
+                            docs[seq] = weight
+            self.chars[token] = docs
+        return docs
+
+
+class SearchIndex:
+    """整个题库的关键词索引，按章节分块；题库重新加载时只重建来源文件有变化的章节"""
+
+    def __init__(self):
+        self.sources: Dict[str, List[int]] = {}
+        self.chapters: List[ChapterIndex] = []
+
+    @classmethod
+    def build(cls, bank: QuestionBank, previous: Optional["SearchIndex"] = None) -> "SearchIndex":
+        """为题库建立索引（会解码全部章节），previous 中来源未变化的章节直接沿用"""
+        index = cls()
+        index.sources = bank.sources
+        reusable: Dict[str, ChapterIndex] = {}
+        if previous is not None:
+            unchanged = bank.unchanged_sources(previous.sources)
+            reusable = {c.title: c for c in previous.chapters if c.source in unchanged}
+        for title in bank.chapter_keys:
+            chapter_index = reusable.get(title)
+            if chapter_index is None:
+                chapter_index = ChapterIndex(title, bank.entry(title)["source"], bank.chapter(title).questions)
+            index.chapters.append(chapter_index)
+        return index
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[int, int, str]]:
+        """按相关度返回 [(章节编号, 题目序号, 题目ID)]
+
+        每个命中的二元组按 idf × 权重（题干高于选项）计分，先按命中的二元组数、再按得分排序。
+        """
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+        total = sum(len(c.question_ids) for c in self.chapters) or 1
+        idf = {}
+        for token in tokens:
+            df = sum(len(c.lookup(token)) for c in self.chapters)
+            if df:
+                idf[token] = math.log(1 + total / df)
+        required = max(1, math.ceil(len(tokens) * MIN_MATCH_RATIO))
+        if len(idf) < required:
+            return []
+
+        candidates = []
+        for chapter_no, chapter in enumerate(self.chapters):
+            matched: Dict[int, List[float]] = {}
+            for token, weight in idf.items():
+                for seq, field_weight in chapter.lookup(token).items():
+                    hit = matched.get(seq)
+                    if hit is None:
+                        hit = matched[seq] = [0, 0.0]
+                    hit[0] += 1
+                    hit[1] += weight * field_weight
+            for seq, (count, score) in matched.items():
+                if count >= required:
+                    candidates.append((count, score, -chapter_no, -seq, chapter.question_ids[seq]))
+        best = heapq.nlargest(limit, candidates)
+        return [(-neg_chapter, -neg_seq, question_id) for _, _, neg_chapter, neg_seq, question_id in best]
@@ -0,0 +1,440 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import aiofiles
+import aiofiles.os
+
+from astrbot.api import logger
+
+from .metrics import Metrics
+
+
+class JsonUserStore:
+    """每个用户一个 JSON 文件的用户数据存储"""
+
+    def __init__(self, root: str):
+        self.root = root
+        # 累计写入次数和字节数
+        self.writes = 0
+        self.bytes_written = 0
+
+    def _path(self, user_id: str) -> str:
+        return os.path.join(self.root, f"{user_id}.json")
+
+    @staticmethod
+    def _dumps(data: Dict) -> str:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+    def load(self, user_id: str) -> Optional[Dict]:
+        """读取用户数据，文件不存在或损坏时返回 None"""
+        path = self._path(user_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"加载用户 {user_id} 数据时出错: {e}")
+            return None
+
+    async def write(self, user_id: str, data: Dict):
+        """异步原子写入：先写临时文件，再重命名覆盖原文件"""
+        # 在第一次 await 之前完成序列化，保证写入的是同一时刻的快照
+        payload = self._dumps(data).encode("utf-8")
+        path = self._path(user_id)
+        tmp_path = path + ".tmp"
+        async with aiofiles.open(tmp_path, "wb") as f:
+            await f.write(payload)
+        await aiofiles.os.replace(tmp_path, path)
+        self.writes += 1
+        self.bytes_written += len(payload)
+
+    def write_sync(self, user_id: str, data: Dict):
+        """同步原子写入（启动时的批量整理使用）"""
+        path = self._path(user_id)
+        tmp_path = path + ".tmp"
+        payload = self._dumps(data).encode("utf-8")
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+        self.writes += 1
+        self.bytes_written += len(payload)
+
+    def iter_user_ids(self) -> Iterator[str]:
+        for fname in sorted(os.listdir(self.root)):
+            if fname.endswith(".json"):
+                yield fname[:-len(".json")]
+
+    def get_format_version(self) -> int:
+        """用户数据格式版本（记录在目录下的 .format_version 文件中）"""
+        try:
+            with open(os.path.join(self.root, ".format_version"), encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def set_format_version(self, version: int):
+        with open(os.path.join(self.root, ".format_version"), "w", encoding="utf-8") as f:
+            f.write(str(version))
+
+    def close(self):
+        """文件存储无需释放资源"""
+
+
+class SqliteUserStore:
+    """基于 SQLite（WAL 模式）的用户数据存储，按行增量更新而不是整份重写"""
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        extra TEXT NOT NULL DEFAULT '{}',
+        updated_at REAL
+    );
+    CREATE TABLE IF NOT EXISTS counters (
+        user_id TEXT NOT NULL,
+        name TEXT NOT NULL,
+        value INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, name)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS wrong_questions (
+        user_id TEXT NOT NULL,
+        question_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (user_id, question_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_wrong_user_seq ON wrong_questions (user_id, seq);
+    CREATE INDEX IF NOT EXISTS idx_wrong_question ON wrong_questions (question_id);
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        # 写入在线程池中执行，用锁串行化写连接的使用（启动时的整理、迁移也走写连接）
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self._SCHEMA)
+        # 缓存未命中时在事件循环线程中读取：WAL 模式下读连接不会被写事务阻塞，因此不与写连接共用锁
+        self._read_conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        # 累计写入次数和写入行数据的字节数
+        self.writes = 0
+        self.bytes_written = 0
+
+    @staticmethod
+    def _is_counter(value) -> bool:
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def load(self, user_id: str) -> Optional[Dict]:
+        """读取用户数据，用户不存在时返回 None（只在事件循环线程中调用，使用独立的读连接）"""
+        cur = self._read_conn.cursor()
+        # 三次查询放在同一个读事务中，看到的是同一时刻的快照
+        cur.execute("BEGIN")
+        try:
+            row = cur.execute("SELECT extra FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                return None
+            counters = cur.execute(
+                "SELECT name, value FROM counters WHERE user_id = ?", (user_id,)
+            ).fetchall()
+            wrong_rows = cur.execute(
+                "SELECT question_id, data FROM wrong_questions WHERE user_id = ? ORDER BY seq", (user_id,)
+            ).fetchall()
+        finally:
+            cur.execute("COMMIT")
+        data = {"wrong_questions": {qid: json.loads(payload) for qid, payload in wrong_rows}}
+        data.update(counters)
+        data.update(json.loads(row[0]))
+        return data
+
+    def _snapshot(self, data: Dict):
+        """把用户数据拆成 (extra, 计数器, 错题行)，在事件循环线程中完成以得到一致的快照"""
+        extra, counters = {}, {}
+        for key, value in data.items():
+            if key == "wrong_questions":
+                continue
+            if self._is_counter(value):
+                counters[key] = value
+            else:
+                extra[key] = value
+        book = data.get("wrong_questions", {})
+        # 错题本为 {题目ID: 元数据}；旧版列表格式（迁移导入时）按条目中的 id 展开
+        items = book.items() if isinstance(book, dict) else ((entry.get("id"), entry) for entry in book)
+        wrong: Dict[str, str] = {
+            str(qid): json.dumps(meta, ensure_ascii=False, separators=(",", ":")) for qid, meta in items
+        }
+        return json.dumps(extra, ensure_ascii=False, separators=(",", ":")), counters, wrong
+
+    def _apply(self, user_id: str, extra: str, counters: Dict[str, int], wrong: Dict[str, str]):
+        """在一个事务内只更新有变化的行"""
+        with self._lock:
+            cur = self.conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                cur.execute(
+                    "INSERT INTO users (user_id, extra, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET extra = excluded.extra, updated_at = excluded.updated_at",
+                    (user_id, extra, time.time()),
+                )
+                old_counters = dict(cur.execute(
+                    "SELECT name, value FROM counters WHERE user_id = ?", (user_id,)
+                ).fetchall())
+                cur.executemany(
+                    "INSERT OR REPLACE INTO counters (user_id, name, value) VALUES (?, ?, ?)",
+                    [(user_id, k, v) for k, v in counters.items() if old_counters.get(k) != v],
+                )
+                existing = {
+                    qid: (seq, payload)
+                    for qid, seq, payload in cur.execute(
+                        "SELECT question_id, seq, data FROM wrong_questions WHERE user_id = ?", (user_id,)
+                    )
+                }
+                removed = [(user_id, qid) for qid in existing if qid not in wrong]
+                cur.executemany("DELETE FROM wrong_questions WHERE user_id = ? AND question_id = ?", removed)
+                next_seq = max((seq for seq, _ in existing.values()), default=-1) + 1
+                changed: List[tuple] = []
+                for qid, payload in wrong.items():
+                    old = existing.get(qid)
+                    if old is None:
+                        changed.append((user_id, qid, next_seq, payload))
+                        next_seq += 1
+                    elif old[1] != payload:
+                        changed.append((user_id, qid, old[0], payload))
+                cur.executemany(
+                    "INSERT OR REPLACE INTO wrong_questions (user_id, question_id, seq, data) "
+                    "VALUES (?, ?, ?, ?)",
+                    changed,
+                )
+                cur.execute("COMMIT")
+                self.writes += 1
+                self.bytes_written += len(extra.encode("utf-8")) + sum(len(row[3].encode("utf-8")) for row in changed)
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    async def write(self, user_id: str, data: Dict):
+        """在线程池中执行增量写入，避免阻塞事件循环"""
+        snapshot = self._snapshot(data)
+        await asyncio.to_thread(self._apply, user_id, *snapshot)
+
+    def write_sync(self, user_id: str, data: Dict):
+        self._apply(user_id, *self._snapshot(data))
+
+    def iter_user_ids(self) -> Iterator[str]:
+        with self._lock:
+            rows = self.conn.execute("SELECT user_id FROM users ORDER BY user_id").fetchall()
+        for (user_id,) in rows:
+            yield user_id
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def get_format_version(self) -> int:
+        return int(self._get_meta("format_version") or 0)
+
+    def set_format_version(self, version: int):
+        self._set_meta("format_version", str(version))
+
+    def migrate_from_json(self, json_root: str) -> int:
+        """一次性导入旧版按用户存放的 JSON 文件，返回导入的用户数"""
+        if self._get_meta("json_migrated") or not os.path.isdir(json_root):
+            return 0
+        json_store = JsonUserStore(json_root)
+        imported = 0
+        for fname in sorted(os.listdir(json_root)):
+            if not fname.endswith(".json"):
+                continue
+            user_id = fname[:-len(".json")]
+            data = json_store.load(user_id)
+            # 已存在于数据库中的用户以数据库为准
+            if data is None or self.load(user_id) is not None:
+                continue
+            self.write_sync(user_id, data)
+            imported += 1
+        self._set_meta("json_migrated", str(time.time()))
+        logger.info(f"已从 {json_root} 导入 {imported} 个用户的数据到 SQLite")
+        return imported
+
+    def close(self):
+        self._read_conn.close()
+        with self._lock:
+            self.conn.close()
+
+
+class UserDataCache:
+    """有容量上限和空闲过期时间的 LRU 用户数据缓存"""
+
+    def __init__(self, max_size: int = 1000, ttl: float = 1800.0,
+                 on_evict: Optional[Callable[[str, Dict], None]] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        # user_id -> (数据, 最近访问时间)，按访问先后排列，最久未访问的在最前
+        self._entries: "OrderedDict[str, Tuple[Dict, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entries))
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        """读取并刷新访问时间，同时统计命中/未命中"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries[user_id] = (entry[0], time.monotonic())
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[0]
+
+    def peek(self, user_id: str) -> Optional[Dict]:
+        """读取但不影响 LRU 顺序和统计"""
+        entry = self._entries.get(user_id)
+        return entry[0] if entry else None
+
+    def put(self, user_id: str, data: Dict):
+        self._entries[user_id] = (data, time.monotonic())
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._evict_oldest()
+
+    def expire(self):
+        """淘汰空闲超过 ttl 的条目（只需从最旧的一端检查）"""
+        deadline = time.monotonic() - self.ttl
+        while self._entries:
+            _, (_, last_access) = next(iter(self._entries.items()))
+            if last_access > deadline:
+                break
+            self._evict_oldest()
+
+    def _evict_oldest(self):
+        user_id, (data, _) = self._entries.popitem(last=False)
+        self.evictions += 1
+        if self.on_evict:
+            self.on_evict(user_id, data)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class WriteBehindWriter:
+    """延迟批量写盘：记录脏用户，定期或脏用户数达到阈值时在后台任务中统一写入"""
+
+    def __init__(self, store: Union[JsonUserStore, SqliteUserStore], interval: float = 5.0, max_pending: int = 50,
+                 metrics: Optional[Metrics] = None):
+        self.store = store
+        self.interval = interval
+        self.max_pending = max_pending
+        self.metrics = metrics
+        # 脏用户集合（user_id -> 数据引用），同一用户的多次修改只会写一次
+        self._pending: Dict[str, Dict] = {}
+        # 正在写入的批次：写完之前仍视为未写盘，避免被淘汰的用户从存储中读到旧数据
+        self._inflight: Dict[str, Dict] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def mark_dirty(self, user_id: str, data: Dict):
+        """标记用户数据待写入"""
+        self._pending[user_id] = data
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+        self._ensure_task()
+
+    def get_pending(self, user_id: str) -> Optional[Dict]:
+        """返回尚未写盘（含正在写入）的用户数据（已被缓存淘汰时用它代替磁盘上的旧数据）"""
+        data = self._pending.get(user_id)
+        return data if data is not None else self._inflight.get(user_id)
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def request_flush(self):
+        """请求后台任务尽快写盘"""
+        if self._pending:
+            self._wakeup.set()
+            self._ensure_task()
+
+    def _ensure_task(self):
+        if self._closed or (self._task is not None and not self._task.done()):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中（如同步调用），留待 flush/close 时写入
+            return
+        self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        # 没有待写数据时任务自行结束，下次标记时再启动
+        while self._pending and not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """立即写入所有脏用户数据"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._inflight = dict(batch)
+            for user_id, data in batch.items():
+                started = time.perf_counter()
+                written = self.store.bytes_written
+                try:
+                    # 各存储在第一次 await 之前完成快照，无需持有用户锁
+                    await self.store.write(user_id, data)
+                    if self.metrics is not None:
+                        self.metrics.observe("shuati_save_seconds", time.perf_counter() - started)
+                        self.metrics.inc("shuati_save_bytes_total", self.store.bytes_written - written)
+                except Exception as e:
+                    logger.error(f"保存用户 {user_id} 数据时出错: {e}")
+                    if self.metrics is not None:
+                        self.metrics.inc("shuati_save_errors_total")
+                    # 写入失败的留到下一轮重试（期间若有更新则以新数据为准）
+                    self._pending.setdefault(user_id, data)
+                finally:
+                    self._inflight.pop(user_id, None)
+
+    async def close(self):
+        """等待后台任务结束并写入剩余数据"""
+        self._closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()